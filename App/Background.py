@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""Heavy work in worker processes
+Results and progress are picked up by a task, so the window keeps rendering meanwhile.
+A running job stops at its next progress report once cancelled, so work has to report progress to be cancellable.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty
+
+from panda3d.core import PStatClient
+
+from App import Stats
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Progress:
+    """Picklable progress callback, passes (stage, done, total) back to the main process
+    Raises Cancelled in the worker once the job is cancelled, so the worker is free for the next job.
+    """
+
+    def __init__(self, queue, cancelled):
+        self.queue = queue
+        self.cancelled = cancelled
+
+    def __call__(self, stage, done, total):
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+        self.queue.put((stage, done, total))
+
+
+def _run(func, stats, *args, **kwargs):
+    """Worker side of a job, joins PStats when the game is connected"""
+    Stats.connect_worker(stats)
+
+    return func(*args, **kwargs)
+
+
+class Job:
+    """Job(build, Cave, 128, 128, on_done=callback, on_progress=callback)
+    func is called in a worker process with additional progress keyword argument
+    """
+
+    __executor = None
+    __manager = None
+    __count = 0
+
+    def __init__(self, func, *args, on_done=None, on_progress=None, **kwargs):
+        if Job.__executor is None:
+            Job.__executor = ProcessPoolExecutor(max_workers=1)
+            Job.__manager = multiprocessing.Manager()
+
+        Job.__count += 1
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.__queue = Job.__manager.Queue()
+        self.__cancelled = Job.__manager.Event()
+        self.__task_name = 'background job {}'.format(Job.__count)
+        self.future = Job.__executor.submit(_run, func, PStatClient.isConnected(), *args,
+                                            progress=Progress(self.__queue, self.__cancelled), **kwargs)
+
+        base.taskMgr.add(self.__poll, self.__task_name)
+
+    def __poll(self, task):
+        while True:
+            try:
+                stage, done, total = self.__queue.get_nowait()
+            except Empty:
+                break
+
+            if self.on_progress is not None:
+                self.on_progress(stage, done, total)
+
+        if not self.future.done():
+            return task.cont
+
+        result = self.future.result()  # raises exception of the worker here
+        if self.on_done is not None:
+            self.on_done(result)
+
+        return task.done
+
+    def cancel(self):
+        """Result of a cancelled job is dropped, on_done is never called"""
+        base.taskMgr.remove(self.__task_name)
+        if not self.future.cancel():
+            self.__cancelled.set()  # already running
+
+    @staticmethod
+    def shutdown():
+        if Job.__executor is not None:
+            Job.__executor.shutdown(wait=False)
+            Job.__manager.shutdown()
+            Job.__executor = Job.__manager = None
@@ -2,6 +2,7 @@
 
 from panda3d.core import Vec3
 
+from App import Stats
 from App.KCC import CharacterController
 
 
@@ -42,12 +43,18 @@ class Dummy:
 
 class Character:
     def __init__(self, world, parent, hero):
+        """
+        :param App.Physics.World world:
+        """
+        self.world = world
         self.hero = hero
         self.name = hero.get('name')
         self.speed = hero.get('speed')
         self.height = hero.get('height')
 
-        self.body = CharacterController(world, parent, self.height, hero.get('crouch_height'), .3, hero.get('width') / 2)
+        self.body = CharacterController(world.world, parent, self.height, hero.get('crouch_height'), .3,
+                                        hero.get('width') / 2, contacts=world.contacts)
+        self.motion = world.track(self.body.node)
 
         self.__move = Vec3(0)
         self.__y_omega = 0
@@ -55,12 +62,24 @@ class Character:
         self.__pitch = 0
 
         self.getPos = self.body.node.getPos
-        self.setPos = self.body.node.setPos
         self.getH = self.body.node.getH
 
+    def destroy(self):
+        with self.world.lock:
+            self.world.untrack(self.body.node)
+            self.body.destroy()
+
     def update(self, dt):
-        self.body.update(dt, self.__move * self.speed, self.__y_omega)
+        Stats.characters.start()
+        self.body.update(dt, *self.controls())
+        self.update_pitch(dt)
+        Stats.characters.stop()
+
+    def controls(self):
+        """Linear and angular velocity the character wants"""
+        return self.__move * self.speed, self.__y_omega
 
+    def update_pitch(self, dt):
         pitch = self.__pitch + self.__p_omega * dt
         if pitch > 90:
             pitch = 90
@@ -68,6 +87,11 @@ class Character:
             pitch = -90
         self.__pitch = pitch
 
+    def setPos(self, *args):
+        with self.world.lock:
+            self.body.setPos(*args)  # controller keeps its own position, the node alone is moved back on update
+            self.motion.reset()
+
     def getHpr(self):
         # pitch = self.body.node.getNetTransform().getMat().getRow3(0)
         # pitch = pitch.x * self.__pitch + pitch.y * self.__pitch + pitch.z * self.__pitch
@@ -77,11 +101,14 @@ class Character:
         return self.__pitch
 
     def setHpr(self, hpr):
-        self.body.node.setH(hpr[0])
-        self.__pitch = hpr[1]
+        with self.world.lock:
+            self.body.node.setH(hpr[0])
+            self.__pitch = hpr[1]
 
     def get_cam_pos(self):
-        return self.body.node.getPos() + self.body.node.getQuat(render).xform(Vec3(0, 0, self.height - .15))
+        """Eyes at transform interpolated between physics ticks"""
+        transform = self.motion.transform
+        return transform.getPos() + transform.getQuat().xform(Vec3(0, 0, self.height - .15))
 
     def move(self, vector):
         if vector.getY() > 0:
@@ -98,13 +125,17 @@ class Character:
         self.__y_omega = omega
 
     def jump(self):
-        self.body.jump(self.hero.get('jump_height'), limit=self.hero.jumps_limit, on_stop=self.hero.reset_jumps_limit)
+        with self.world.lock:  # casts rays, key handlers call it while a threaded world may step
+            self.body.jump(self.hero.get('jump_height'), limit=self.hero.jumps_limit,
+                           on_stop=self.hero.reset_jumps_limit)
 
     def crouch(self, start):
-        self.body.crouch(start)
+        with self.world.lock:  # swaps capsules in the world
+            self.body.crouch(start)
 
     def fly(self, start):
-        self.body.float() if start else self.body.fall()
+        with self.world.lock:
+            self.body.float() if start else self.body.fall()
 
     def ability1(self, start):
         print('ability1', start)
@@ -120,3 +151,62 @@ class Character:
 
     def fire2(self):
         print('secondary fired')
+
+
+class CharacterManager:
+    """Updates all characters of a World together on every tick
+    Every phase of the controllers runs for all characters before the next one starts,
+    so contact rays, state machines and penetration fixes each are one tight loop.
+    """
+
+    def __init__(self, world):
+        """
+        :param App.Physics.World world:
+        """
+        self.world = world
+        self.characters = []
+
+        world.add_tick_callback(self.update)
+
+    def add(self, char):
+        with self.world.lock:  # update walks the list on the worker of a threaded world
+            self.characters.append(char)
+            self.world.lod.add_focus(char.body.node)
+
+    def remove(self, char):
+        with self.world.lock:
+            if char in self.characters:
+                self.characters.remove(char)
+                self.world.lod.remove_focus(char.body.node)
+
+    def __contains__(self, char):
+        return char in self.characters
+
+    def __len__(self):
+        return len(self.characters)
+
+    def update(self, dt):
+        Stats.characters.start()
+        chars = self.characters
+        bodies = [char.body for char in chars]
+
+        for body in bodies:
+            body.update_contacts(dt)
+        for body in bodies:
+            body.process_state()
+        for char in chars:
+            char.body.apply_movement(*char.controls())
+        for body in bodies:
+            body.prevent_penetration()
+        for body in bodies:
+            body.finish_update()
+        for char in chars:
+            char.update_pitch(dt)
+        Stats.characters.stop()
+
+    def destroy(self):
+        with self.world.lock:
+            self.world.remove_tick_callback(self.update)
+            for char in self.characters:
+                self.world.lod.remove_focus(char.body.node)
+            self.characters = []
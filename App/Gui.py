@@ -6,6 +6,7 @@ from direct.gui.OnscreenImage import OnscreenImage
 from direct.gui.OnscreenText import OnscreenText
 from direct.showbase.DirectObject import DirectObject
 
+from App import Stats
 from App.Options import Options
 from Utils.format import clamp_texture
 
@@ -46,8 +47,10 @@ class CharMarks(HasFrame):
         del self.heights[name]
 
     def update(self, task):
+        Stats.char_marks.start()
         for name, char in self.chars.items():
             self.marks[name].setPos(*self.get_pos(char, self.heights[name]))
+        Stats.char_marks.stop()
 
         return task.cont
 
@@ -356,6 +359,15 @@ class Loading(HasFrame):
 
         base.accept('Loading', self.show)
         base.accept('Loaded', self.hide)
+        base.accept('Loading-progress', self.progress)
+
+    def show(self):
+        self.frame['text'] = 'Loading...'
+        HasFrame.show(self)
+
+    def progress(self, stage, done, total):
+        percent = int(done * 100 / total) if total else 0
+        self.frame['text'] = 'Loading...\n{} {}%'.format(stage, percent)
 
 
 class MainMenu(HasFrame):
@@ -7,18 +7,37 @@ see https://github.com/peterpodgorski/panda3d-bullet-kcc
 """
 
 from panda3d.core import Vec3, Point3, Quat, BitMask32
-from panda3d.bullet import BulletCapsuleShape, BulletRigidBodyNode, BulletGhostNode
+from panda3d.bullet import BulletCapsuleShape, BulletRigidBodyNode
 
 import math
 
+from App import Stats
+from App.Physics import MASK_RAY, ContactIndex
+
+_UP = Vec3.up()
+
+
+class Contact:
+    """Closest ray hit, every controller reuses its records instead of making new ones each tick"""
+
+    __slots__ = ('pos', 'node', 'normal')
+
+    def __init__(self):
+        self.pos = self.node = self.normal = None
+
 
 class CharacterController:
-    def __init__(self, world, parent, walk_height, crouch_height, step_height, radius, gravity=None):
+    def __init__(self, world, parent, walk_height, crouch_height, step_height, radius, gravity=None,
+                 head_ray_length=None, contacts=None):
+        """
+        contacts -- (ContactIndex) index updated by World, a private one is built every update when missing
+        """
 
         self.capsule, self.capsule_node, self.__capsule_h, self.__levitation = None, None, None, None
         self.__capsule_r, self.__h, self.__capsule_offset, self.__foot_distance = None, None, None, None
 
         self.__world = world
+        self.__contacts = contacts
         self.__parent = parent
         self.__time_step = 0
         self.__current_pos = Vec3(0, 0, 0)
@@ -52,12 +71,30 @@ class CharacterController:
         self.__fall_start_pos = self.__current_pos.z
         self.__linear_velocity = Vec3(0, 0, 0)
         self.__head_contact = None
+        self.__head_stale = True  # head ray is cast on demand, once per tick at most
         self.__foot_contact = None
+        self.__head_record = Contact()
+        self.__foot_record = Contact()
         self.__enabled_crouch = False
 
+        # Scratch vectors of the update, reused to keep it free of allocations where Panda allows
+        self.__ray_to = Point3()
+        self.__collisions = Vec3()
+
+        # Contact rays return only the closest hit of bodies matching the mask, ghosts are left out
+        self.ray_mask = MASK_RAY
+        self.head_ray_length = head_ray_length  # None means 20 capsule heights
+
         self.__stand_up_callback = [None, [], {}]
         self.__fall_callback = [None, [], {}]
 
+        self.__process_states = {
+            "ground": self.__process_ground,
+            "jumping": self.__process_jumping,
+            "falling": self.__process_falling,
+            "flying": self.__process_flying,
+        }
+
     def setCollideMask(self, *args):
         self.__walk_capsule_node.setCollideMask(*args)
         self.__crouch_capsule_node.setCollideMask(*args)
@@ -122,6 +159,7 @@ class CharacterController:
 
         self.__capsule_offset = self.__capsule_h * 0.5 + self.__levitation
         self.__foot_distance = self.__capsule_offset + self.__levitation
+        self.__head_stale = True
 
     def stop_crouch(self):
         """
@@ -137,10 +175,10 @@ class CharacterController:
         if self.__foot_contact is None:
             return False
         elif self.movement_state == "ground":
-            elevation = self.__current_pos.z - self.__foot_contact[0].z
+            elevation = self.__current_pos.z - self.__foot_contact.pos.z
             return elevation <= self.__levitation + 0.02
         else:
-            return self.__current_pos <= self.__foot_contact[0]
+            return self.__current_pos <= self.__foot_contact.pos
 
     def jump(self, max_height=3.0, **kwargs):
         """
@@ -166,26 +204,33 @@ class CharacterController:
     def update(self, dt, move, turn):
         """
         Update method. Call this around doPhysics.
+        CharacterManager runs the same phases for all characters at once.
         """
-        process_states = {
-            "ground": self.__process_ground,
-            "jumping": self.__process_jumping,
-            "falling": self.__process_falling,
-            "flying": self.__process_flying,
-        }
-
+        self.update_contacts(dt)
+        self.process_state()
+        self.apply_movement(move, turn)
+        self.prevent_penetration()
+        self.finish_update()
+
+    def update_contacts(self, dt):
+        """First phase, starts the tick and casts foot ray, head ray waits until some state asks for it"""
         self.__time_step = dt
 
-        self.__update_foot_contact()
-        self.__update_head_contact()
+        Stats.kcc_contacts.start()
+        self.__update_foot_contact(self.capsule_node.getPos(render))
+        self.__head_stale = True
+        Stats.kcc_contacts.stop()
 
-        process_states[self.movement_state]()
+    def process_state(self):
+        self.__process_states[self.movement_state]()
 
+    def apply_movement(self, move, turn):
         self.set_angular_movement(turn)
         self.set_linear_movement(move)
         self.__apply_linear_velocity()
-        self.__prevent_penetration()
 
+    def finish_update(self):
+        """Last phase, moves the nodes"""
         self.__update_capsule()
 
         if self.isCrouching and not self.__enabled_crouch:
@@ -207,8 +252,10 @@ class CharacterController:
 
         max_z += self.__current_pos.z
 
-        if self.__intelligent_jump and self.__head_contact is not None and self.__head_contact[0].z < max_z + self.__h:
-            max_z = self.__head_contact[0].z - self.__h * 1.2
+        if self.__intelligent_jump:
+            head = self.__get_head_contact()
+            if head is not None and head.pos.z < max_z + self.__h:
+                max_z = head.pos.z - self.__h * 1.2
 
         max_z = round(max_z, 2)
 
@@ -226,10 +273,9 @@ class CharacterController:
         self.movement_state = "jumping"
 
     def __stand_up(self):
-        self.__update_head_contact()
+        head = self.__get_head_contact()
 
-        if self.__head_contact is not None\
-                and self.__current_pos.z + self.__walk_levitation + self.__walk_capsule_h >= self.__head_contact[0].z:
+        if head is not None and self.__current_pos.z + self.__walk_levitation + self.__walk_capsule_h >= head.pos.z:
             return
 
         self.isCrouching = False
@@ -255,16 +301,13 @@ class CharacterController:
         if not self.is_on_ground():
             self.__fall()
         else:
-            self.__current_pos.z = self.__foot_contact[0].z
+            self.__current_pos.z = self.__foot_contact.pos.z
 
     def __process_falling(self):
         self.__fall_time += self.__time_step
         self.fall_delta = self.gravity * self.__fall_time ** 2
 
-        new_pos = Vec3(self.__current_pos)
-        new_pos.z = self.__fall_start_pos + self.fall_delta
-
-        self.__current_pos = new_pos
+        self.__current_pos.z = self.__fall_start_pos + self.fall_delta
 
         if self.is_on_ground():
             self.__land()
@@ -272,12 +315,11 @@ class CharacterController:
                 self.__fall_callback[0](self.__fall_start_pos, *self.__fall_callback[1], **self.__fall_callback[2])
 
     def __process_jumping(self):
-        if self.__head_contact is not None and self.__capsuleTop >= self.__head_contact[0].z:
+        head = self.__get_head_contact()
+        if head is not None and self.__capsuleTop >= head.pos.z:
             self.__fall()
             return
 
-        old_pos = float(self.__current_pos.z)
-
         self.jump_time += self.__time_step
 
         self.__current_pos.z = self.gravity * self.jump_time ** 2\
@@ -287,13 +329,15 @@ class CharacterController:
             self.__fall()
 
     def __process_flying(self):
-        if self.__foot_contact and self.__current_pos.z - 0.1 < self.__foot_contact[0].z\
+        if self.__foot_contact and self.__current_pos.z - 0.1 < self.__foot_contact.pos.z\
                 and self.__linear_velocity.z < 0.0:
-            self.__current_pos.z = self.__foot_contact[0].z
+            self.__current_pos.z = self.__foot_contact.pos.z
             self.__linear_velocity.z = 0.0
 
-        if self.__head_contact and self.__capsuleTop >= self.__head_contact[0].z and self.__linear_velocity.z > 0.0:
-            self.__linear_velocity.z = 0.0
+        if self.__linear_velocity.z > 0.0:
+            head = self.__get_head_contact()
+            if head is not None and self.__capsuleTop >= head.pos.z:
+                self.__linear_velocity.z = 0.0
 
     def __check_future_space(self, global_vel):
         global_vel = global_vel * self.future_space_prediction_distance
@@ -302,8 +346,9 @@ class CharacterController:
         p_up = Point3(p_from + Point3(0, 0, self.__capsule_h * 2.0))
         p_down = Point3(p_from - Point3(0, 0, self.__capsule_h * 2.0 + self.__levitation))
 
-        up_test = self.__world.rayTestClosest(p_from, p_up)
-        down_test = self.__world.rayTestClosest(p_from, p_down)
+        up_test = self.__world.rayTestClosest(p_from, p_up, self.ray_mask)
+        down_test = self.__world.rayTestClosest(p_from, p_down, self.ray_mask)
+        Stats.raycasts.addLevel(2)
 
         if not (up_test.hasHit() and down_test.hasHit()):
             return True
@@ -319,68 +364,71 @@ class CharacterController:
 
         return True
 
-    def __update_foot_contact(self):
-        p_from = Point3(self.capsule_node.getPos(render))
-        p_to = Point3(p_from - Point3(0, 0, self.__foot_distance))
-        result = self.__world.rayTestAll(p_from, p_to)
+    def __update_foot_contact(self, p_from):
+        p_to = self.__ray_to
+        p_to.set(p_from.x, p_from.y, p_from.z - self.__foot_distance)
+        hit = self.__world.rayTestClosest(p_from, p_to, self.ray_mask)
+        Stats.raycasts.addLevel(1)
 
-        if not result.hasHits():
+        if not hit.hasHit():
             self.__foot_contact = None
             return
 
-        sorted_hits = sorted(result.getHits(), key=lambda h: (p_from - h.getHitPos()).length())
+        contact = self.__foot_contact = self.__foot_record
+        contact.pos = hit.getHitPos()
+        contact.node = hit.getNode()
+        contact.normal = hit.getHitNormal()
 
-        for hit in sorted_hits:
-            if type(hit.getNode()) is BulletGhostNode:
-                continue
+    def __get_head_contact(self):
+        """Head contact cached until the capsule moves"""
+        if self.__head_stale:
+            self.__update_head_contact()
 
-            self.__foot_contact = [hit.getHitPos(), hit.getNode(), hit.getHitNormal()]
-            break
+        return self.__head_contact
 
     def __update_head_contact(self):
-        p_from = Point3(self.capsule_node.getPos(render))
-        p_to = Point3(p_from + Point3(0, 0, self.__capsule_h * 20.0))
-        result = self.__world.rayTestAll(p_from, p_to)
-
-        if not result.hasHits():
+        self.__head_stale = False
+
+        p_from = self.capsule_node.getPos(render)
+        length = self.__capsule_h * 20.0 if self.head_ray_length is None else self.head_ray_length
+        p_to = self.__ray_to
+        p_to.set(p_from.x, p_from.y, p_from.z + length)
+        Stats.kcc_contacts.start()
+        hit = self.__world.rayTestClosest(p_from, p_to, self.ray_mask)
+        Stats.kcc_contacts.stop()
+        Stats.raycasts.addLevel(1)
+
+        if not hit.hasHit():
             self.__head_contact = None
             return
 
-        sorted_hits = sorted(result.getHits(), key=lambda h: (p_from - h.getHitPos()).length())
-
-        for hit in sorted_hits:
-            if type(hit.getNode()) is BulletGhostNode:
-                continue
-
-            self.__head_contact = [hit.getHitPos(), hit.getNode()]
-            break
+        contact = self.__head_contact = self.__head_record
+        contact.pos = hit.getHitPos()
+        contact.node = hit.getNode()
 
     def __update_capsule(self):
         self.node.setPos(self.__current_pos)
         self.capsule_node.setPos(0, 0, self.__capsule_offset)
 
         self.__capsuleTop = self.__current_pos.z + self.__levitation + self.__capsule_h * 2.0
+        self.__head_stale = True
 
     def __apply_linear_velocity(self):
-        global_vel = self.node.getQuat(render).xform(self.__linear_velocity) * self.__time_step
+        global_vel = self.node.getQuat(render).xform(self.__linear_velocity)
+        global_vel *= self.__time_step
 
         if self.predict_future_space and not self.__check_future_space(global_vel):
             return
 
         if self.__foot_contact is not None and self.min_slope_dot and self.movement_state != "flying":
-            normal_vel = Vec3(global_vel)
-            normal_vel.normalize()
-
-            floor_normal = self.__foot_contact[2]
-            abs_slope_dot = round(floor_normal.dot(Vec3.up()), 2)
-
-            def apply_gravity():
-                self.__current_pos -= Vec3(floor_normal.x, floor_normal.y, 0.0) * self.gravity * self.__time_step * 0.1
+            floor_normal = self.__foot_contact.normal
+            abs_slope_dot = round(floor_normal.dot(_UP), 2)
+            moves = global_vel.lengthSquared() > 0.0
 
             if abs_slope_dot <= self.min_slope_dot:
-                apply_gravity()
+                self.__slide_down(floor_normal)
 
-                if global_vel != Vec3():
+                if moves:
                     global_vel_dir = Vec3(global_vel)
                     global_vel_dir.normalize()
 
@@ -389,34 +437,47 @@ class CharacterController:
 
                     vel_dot = 1.0 - global_vel_dir.angleDeg(fn) / 180.0
                     if vel_dot < 0.5:
-                        self.__current_pos -= Vec3(fn.x * global_vel.x, fn.y * global_vel.y, 0.0) * vel_dot
+                        self.__current_pos.x -= fn.x * global_vel.x * vel_dot
+                        self.__current_pos.y -= fn.y * global_vel.y * vel_dot
 
                     global_vel *= vel_dot
 
-            elif self.__slope_affects_speed and global_vel != Vec3():
-                apply_gravity()
+            elif self.__slope_affects_speed and moves:
+                self.__slide_down(floor_normal)
 
         self.__current_pos += global_vel
 
-    def __prevent_penetration(self):
-        collisions = Vec3()
-
-        for mf in self.__world.getManifolds():
-            if not (mf.getNumManifoldPoints() and self.capsule_node.node() in [mf.getNode0(), mf.getNode1()]):
-                continue
-
-            sign = 1 if mf.getNode0() == self.capsule_node.node() else -1
-
-            for m_point in mf.getManifoldPoints():
-                direction = m_point.getPositionWorldOnB() - m_point.getPositionWorldOnA()
-                normal = Vec3(direction)
-                normal.normalize()
-
-                if m_point.getDistance() < 0:
-                    collisions -= direction * m_point.getDistance() * 2.0 * sign
+    def __slide_down(self, floor_normal):
+        k = self.gravity * self.__time_step * 0.1
+        self.__current_pos.x -= floor_normal.x * k
+        self.__current_pos.y -= floor_normal.y * k
+
+    def prevent_penetration(self):
+        Stats.kcc_penetration.start()
+        contacts = self.__contacts
+        if contacts is None:
+            contacts = ContactIndex()
+            contacts.rebuild(self.__world)
+
+        collisions = self.__collisions
+        collisions.set(0.0, 0.0, 0.0)
+
+        for other, sign, points in contacts.get(self.capsule_node.node()):
+            for m_point in points:
+                distance = m_point.getDistance()
+                if distance < 0:
+                    direction = m_point.getPositionWorldOnB() - m_point.getPositionWorldOnA()
+                    direction *= distance * 2.0 * sign
+                    collisions -= direction
 
         collisions.z = 0.0
         self.__current_pos += collisions
+        Stats.kcc_penetration.stop()
+
+    def destroy(self):
+        """Take the capsule out of the world and remove the nodes"""
+        self.__world.removeRigidBody(self.capsule_node.node())
+        self.node.removeNode()
 
     def __map_methods(self):
         self.getHpr = self.node.getHpr
@@ -441,6 +502,7 @@ class CharacterController:
     def setPos(self, *args):
         self.node.setPos(*args)
         self.__current_pos = self.node.getPos(render)
+        self.__head_stale = True
 
     def setX(self, *args):
         self.node.setX(*args)
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
+import os
+
 from direct.fsm.FSM import FSM
 
 from Scenes import *
 from Utils import win
+from Utils.mapGenerators import build
+from App.Background import Job
 from App.Gui import PauseMenu, OptionsMenu, MainMenu, GameModesMenu
 from App.Console import DeveloperConsole
 
@@ -14,6 +18,7 @@ class GameManager(FSM):
 
         self.console = ConsoleManager()
         self.mgr = None
+        self.job = None
         base.scene = None
         self.scene_holder = render.attachNewNode('Scene holder')
 
@@ -40,19 +45,32 @@ class GameManager(FSM):
         self.mgr = None
 
     def enterGame(self, mode):
+        """Level is generated in background, scene is made once it arrives"""
         win.hide_cursor()
 
-        base.scene = Game.Game(self.scene_holder, mode)
-        self.mgr = OverlayManager()
+        def loaded(level):
+            self.job = None
+            base.scene = Game.Game(self.scene_holder, mode, level)
+            self.mgr = OverlayManager()
 
-        base.messenger.send('Loaded')
+            base.messenger.send('Loaded')
+
+        def progress(stage, done, total):
+            base.messenger.send('Loading-progress', [stage, done, total])
+
+        cache_dir = os.path.join(base.get_user_dir(), 'cache', 'maps')
+        self.job = Job(build, on_done=loaded, on_progress=progress, cache_dir=cache_dir, **Game.Game.level_for(mode))
 
     def exitGame(self):
         base.messenger.send('Loading')
 
-        base.scene.destroy()
-        self.mgr.destroy()
-        self.mgr = None
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+        else:
+            base.scene.destroy()
+            self.mgr.destroy()
+            self.mgr = None
 
         win.show_cursor()
 
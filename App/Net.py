@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+
+"""Authoritative server and clients of a duel over UDP
+
+Server runs physics and characters at the fixed tick rate of World, clients only send input commands
+and get snapshots of every character back. Each packet is one datagram starting with its kind byte:
+
+    CONNECT     client -> server    protocol version
+    ACCEPT      server -> client    client id, tick rate, mode
+    REJECT      server -> client    reason
+    INPUT       client -> server    sequence, move, yaw and pitch omegas, buttons, jump and ultimate counters
+    SNAPSHOT    server -> client    tick, last input sequence of the client, id, position and hpr of characters
+    DISCONNECT  both ways
+
+Inputs are states instead of events, so a lost datagram is covered by the next one.
+One shot actions are counters, server performs them as many times as the counter grew, but at most
+MAX_ACTIONS per packet, so a forged counter can not trigger a burst of them.
+"""
+
+import math
+import time
+import socket
+import struct
+import random
+
+from panda3d.core import Vec3, Point3
+
+from App.Characters import Character, CharacterManager
+from App.Hero import get_active_hero
+from Utils import regions
+
+PROTOCOL = 1
+PORT = 7777
+MAX_DATAGRAM = 1400
+MAX_OMEGA = 7200.0  # degrees per second a client may turn or pitch with, fast mouse flicks stay below it
+MAX_ACTIONS = 1  # jumps or ultimates performed per INPUT packet, a client sends one every frame
+
+CONNECT, ACCEPT, REJECT, INPUT, SNAPSHOT, DISCONNECT = range(1, 7)
+REJECT_FULL, REJECT_VERSION = 1, 2
+
+CROUCH, ABILITY1, ABILITY2, FIRE1, FIRE2 = 1, 2, 4, 8, 16
+_HELD = ((CROUCH, 'crouch'), (ABILITY1, 'ability1'), (ABILITY2, 'ability2'))
+
+_KIND = struct.Struct('<B')
+_CONNECT = struct.Struct('<BH')
+_ACCEPT = struct.Struct('<BBH')  # mode follows as utf8
+_REJECT = struct.Struct('<BB')
+_INPUT = struct.Struct('<BI5fBBB')
+_SNAPSHOT = struct.Struct('<BIIB')
+_STATE = struct.Struct('<B5f')
+
+
+def _clamp(value, limit):
+    return max(-limit, min(value, limit))
+
+
+def spawn_points(grid, count, seed=None, cell_size=1.0, height=1.0):
+    """Centres of distinct random empty cells of the largest region, so every spawn can reach the others
+    and characters of different clients never start inside each other. Cells repeat only when the region
+    has fewer of them than count.
+    """
+    rnd = random.Random(seed)
+    cells = [(x, y) for y, begin, end in regions.label(grid)[0].runs for x in range(begin, end)]
+    picked = rnd.sample(cells, min(count, len(cells)))
+    points = []
+
+    for i in range(count):
+        x, y = picked[i % len(picked)]
+        points.append(Point3((x + .5) * cell_size, (y + .5) * cell_size, height))
+
+    return points
+
+
+class Command:
+    """Input of the local player, Player.Controller drives it in place of a Character
+    Position and hpr are the ones of the last snapshot, so camera can follow the character of the server.
+    """
+
+    def __init__(self):
+        self.sequence = 0
+        self.pos = Point3(0)
+        self.hpr = Vec3(0)
+        self.height = 1.75
+
+        self.__move = Vec3(0)
+        self.__yaw = 0
+        self.__pitch = 0
+        self.__buttons = 0
+        self.__jumps = 0
+        self.__ultimates = 0
+
+    def pack(self):
+        """Next INPUT packet, fire buttons are sent once per call of fire"""
+        self.sequence += 1
+        data = _INPUT.pack(INPUT, self.sequence, self.__move.x, self.__move.y, self.__move.z, self.__yaw, self.__pitch,
+                           self.__buttons, self.__jumps, self.__ultimates)
+        self.__buttons &= ~(FIRE1 | FIRE2)
+
+        return data
+
+    def getPos(self, *args):
+        return Point3(self.pos)
+
+    def getH(self):
+        return self.hpr.x
+
+    def getHpr(self):
+        return Vec3(self.hpr)
+
+    def setPos(self, *args):
+        pass  # server owns the position
+
+    def setHpr(self, hpr):
+        pass
+
+    def get_cam_pos(self):
+        return self.pos + Vec3(0, 0, self.height - .15)
+
+    def move(self, vector):
+        self.__move = Vec3(vector)
+
+    def stop(self):
+        self.__move = Vec3(0)
+
+    def turn(self, omega):
+        self.__yaw = omega
+
+    def pitch(self, omega):
+        self.__pitch = omega
+
+    def jump(self):
+        self.__jumps = (self.__jumps + 1) % 256
+
+    def ability3(self):
+        self.__ultimates = (self.__ultimates + 1) % 256
+
+    def __hold(self, button, start):
+        if start:
+            self.__buttons |= button
+        else:
+            self.__buttons &= ~button
+
+    def crouch(self, start):
+        self.__hold(CROUCH, start)
+
+    def ability1(self, start):
+        self.__hold(ABILITY1, start)
+
+    def ability2(self, start):
+        self.__hold(ABILITY2, start)
+
+    def fire1(self):
+        self.__buttons |= FIRE1
+
+    def fire2(self):
+        self.__buttons |= FIRE2
+
+
+class Remote:
+    """Client as the server sees it"""
+
+    __slots__ = ('id', 'address', 'char', 'sequence', 'buttons', 'jumps', 'ultimates', 'seen')
+
+    def __init__(self, client_id, address, char):
+        self.id = client_id
+        self.address = address
+        self.char = char
+        self.sequence = 0
+        self.buttons = 0
+        self.jumps = 0
+        self.ultimates = 0
+        self.seen = time.monotonic()
+
+    def apply(self, data):
+        """Set controls of the character from an INPUT packet
+        Packets older than the last applied one or with non finite numbers are dropped,
+        move axes are clamped to [-1, 1], omegas to MAX_OMEGA and one shot actions to MAX_ACTIONS,
+        so a client can not outrun the others.
+        """
+        _, sequence, mx, my, mz, yaw, pitch, buttons, jumps, ultimates = _INPUT.unpack(data)
+        if sequence <= self.sequence or not all(map(math.isfinite, (mx, my, mz, yaw, pitch))):
+            return
+        self.sequence = sequence
+
+        char = self.char
+        char.move(Vec3(_clamp(mx, 1.0), _clamp(my, 1.0), _clamp(mz, 1.0)))
+        char.turn(_clamp(yaw, MAX_OMEGA))
+        char.pitch(_clamp(pitch, MAX_OMEGA))
+
+        for button, action in _HELD:
+            if (buttons ^ self.buttons) & button:
+                getattr(char, action)(bool(buttons & button))
+        if buttons & FIRE1:
+            char.fire1()
+        if buttons & FIRE2:
+            char.fire2()
+        self.buttons = buttons
+
+        for _ in range(min((jumps - self.jumps) % 256, MAX_ACTIONS)):
+            char.jump()
+        for _ in range(min((ultimates - self.ultimates) % 256, MAX_ACTIONS)):
+            char.ability3()
+        self.jumps, self.ultimates = jumps, ultimates
+
+
+class Server:
+    """Dedicated server of a World: owns the characters and sends snapshots of them to every client"""
+
+    def __init__(self, world, parent, spawns, address=('', PORT), mode='default', max_clients=8, snapshot_interval=1,
+                 timeout=5.0):
+        """
+        :param App.Physics.World world:
+        :param List spawns: points characters of new clients appear at, in turn
+        :param Int snapshot_interval: ticks between snapshots
+        :param Float timeout: seconds of silence after which a client is dropped
+        """
+        self.world = world
+        self.parent = parent
+        self.spawns = spawns
+        self.mode = mode
+        self.max_clients = max_clients
+        self.snapshot_interval = snapshot_interval
+        self.timeout = timeout
+
+        self.characters = CharacterManager(world)
+        self.clients = {}  # address: Remote
+        self.received = self.sent = 0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(address)
+        self.socket.setblocking(False)
+        self.address = self.socket.getsockname()
+
+        self.__next_id = 1
+
+    def poll(self):
+        """Handle all datagrams waiting in the socket"""
+        while True:
+            try:
+                data, address = self.socket.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            if not data:
+                continue
+
+            self.received += 1
+            kind = data[0]
+            remote = self.clients.get(address)
+
+            if remote is not None:
+                remote.seen = time.monotonic()
+                if kind == INPUT and len(data) == _INPUT.size:
+                    remote.apply(data)
+                elif kind == CONNECT:
+                    self.__accept(remote)  # accept got lost
+                elif kind == DISCONNECT:
+                    self.drop(remote)
+            elif kind == CONNECT and len(data) == _CONNECT.size:
+                self.__connect(data, address)
+
+    def __connect(self, data, address):
+        _, version = _CONNECT.unpack(data)
+        if version != PROTOCOL:
+            self.__send(_REJECT.pack(REJECT, REJECT_VERSION), address)
+        elif len(self.clients) >= self.max_clients:
+            self.__send(_REJECT.pack(REJECT, REJECT_FULL), address)
+        else:
+            char = Character(self.world, self.parent, get_active_hero())
+            char.setPos(self.spawns[self.__next_id % len(self.spawns)])
+            self.characters.add(char)
+
+            remote = self.clients[address] = Remote(self.__next_id, address, char)
+            self.__next_id = self.__next_id % 255 + 1
+            used = {other.id for other in self.clients.values()}
+            while self.__next_id in used:
+                self.__next_id = self.__next_id % 255 + 1
+            self.__accept(remote)
+
+    def __accept(self, remote):
+        self.__send(_ACCEPT.pack(ACCEPT, remote.id, self.world.tick_rate) + self.mode.encode('utf8'), remote.address)
+
+    def drop(self, remote):
+        del self.clients[remote.address]
+        self.characters.remove(remote.char)
+        remote.char.destroy()
+
+    def tick(self):
+        """Apply inputs, step the world and send a snapshot when it is time to"""
+        self.poll()
+        self.world.tick()
+
+        if self.world.ticks % self.snapshot_interval == 0:
+            self.snapshot()
+
+        now = time.monotonic()
+        for remote in list(self.clients.values()):
+            if now - remote.seen > self.timeout:
+                self.drop(remote)
+
+    def snapshot(self):
+        """States are packed once, only the header with the acknowledged input differs between clients"""
+        states = []
+        for remote in self.clients.values():
+            pos, hpr = remote.char.getPos(), remote.char.getHpr()
+            states.append(_STATE.pack(remote.id, pos.x, pos.y, pos.z, hpr.x, hpr.y))
+        states = b''.join(states)
+
+        for remote in self.clients.values():
+            header = _SNAPSHOT.pack(SNAPSHOT, self.world.ticks, remote.sequence, len(self.clients))
+            self.__send(header + states, remote.address)
+
+    def run(self, ticks=0, on_tick=None):
+        """Tick at the rate of the world until given number of ticks is done, 0 runs forever
+        :param Callable on_tick: called after each tick with its number
+        """
+        dt = self.world.tick_dt
+        next_tick = time.perf_counter()
+        done = 0
+
+        while not ticks or done < ticks:
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -dt * 10:
+                next_tick = time.perf_counter()  # too late to catch up, skip the backlog
+
+            self.tick()
+            done += 1
+            next_tick += dt
+
+            if on_tick is not None:
+                on_tick(done)
+
+    def __send(self, data, address):
+        try:
+            self.socket.sendto(data, address)
+            self.sent += 1
+        except (BlockingIOError, OSError):
+            pass  # full buffer is one more lost datagram
+
+    def close(self):
+        for remote in list(self.clients.values()):
+            self.__send(_KIND.pack(DISCONNECT), remote.address)
+            self.drop(remote)
+
+        self.characters.destroy()
+        self.socket.close()
+
+
+class Client:
+    """Sends commands to a Server and keeps the last snapshot of all characters"""
+
+    def __init__(self, address, command=None, timeout=5.0, retry=.5):
+        """
+        :param Tuple address: (host, port) of the server
+        :param Command command: input sent by send, a new one is made when missing
+        """
+        self.command = command or Command()
+        self.timeout = timeout
+        self.retry = retry
+
+        self.id = None
+        self.tick_rate = None
+        self.mode = None
+        self.rejected = None
+        self.tick = -1
+        self.ack = 0
+        self.states = {}  # id: (Point3, Vec3 hpr)
+        self.rtt = None
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.connect(address)
+        self.socket.setblocking(False)
+
+        self.__sent = {}  # sequence: send time
+        self.__connect_time = self.__seen = None
+
+    @property
+    def connected(self):
+        return self.id is not None
+
+    def connect(self):
+        """Ask to join, poll repeats it until the server answers"""
+        self.__connect_time = self.__seen = time.monotonic()
+        self.__send(_CONNECT.pack(CONNECT, PROTOCOL))
+
+    def send(self):
+        """Send current state of the command"""
+        if self.connected:
+            self.__sent[self.command.sequence + 1] = time.monotonic()
+            self.__send(self.command.pack())
+
+    def poll(self):
+        """Handle all datagrams waiting in the socket
+        :return: False once the server rejected, disconnected or stopped answering
+        """
+        if self.rejected is not None:
+            return False
+        now = time.monotonic()
+
+        while True:
+            try:
+                data = self.socket.recv(MAX_DATAGRAM)
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+            if not data:
+                continue
+
+            self.__seen = now
+            kind = data[0]
+
+            if kind == ACCEPT and len(data) >= _ACCEPT.size:
+                _, self.id, self.tick_rate = _ACCEPT.unpack_from(data)
+                self.mode = data[_ACCEPT.size:].decode('utf8')
+            elif kind == SNAPSHOT and len(data) >= _SNAPSHOT.size:
+                self.__snapshot(data, now)
+            elif kind == REJECT and len(data) == _REJECT.size:
+                self.rejected = data[1]
+                return False
+            elif kind == DISCONNECT:
+                self.id = None
+                return False
+
+        if self.__seen is not None and now - self.__seen > self.timeout:
+            self.id = None
+            return False
+
+        if not self.connected and self.__connect_time is not None and now - self.__connect_time > self.retry:
+            self.__connect_time = now
+            self.__send(_CONNECT.pack(CONNECT, PROTOCOL))
+
+        return True
+
+    def __snapshot(self, data, now):
+        _, tick, ack, count = _SNAPSHOT.unpack_from(data)
+        if tick <= self.tick or len(data) != _SNAPSHOT.size + count * _STATE.size:
+            return  # out of order or broken
+
+        self.tick = tick
+        self.states = {}
+        for char_id, x, y, z, h, p in _STATE.iter_unpack(data[_SNAPSHOT.size:]):
+            self.states[char_id] = Point3(x, y, z), Vec3(h, p, 0)
+
+        own = self.states.get(self.id)
+        if own is not None:
+            self.command.pos, self.command.hpr = own
+
+        if ack > self.ack:
+            self.ack = ack
+            sent = self.__sent.pop(ack, None)
+            if sent is not None:
+                self.rtt = now - sent
+            for sequence in [sequence for sequence in self.__sent if sequence < ack]:
+                del self.__sent[sequence]
+
+    def __send(self, data):
+        try:
+            self.socket.send(data)
+        except (BlockingIOError, ConnectionRefusedError):
+            pass
+
+    def close(self):
+        if self.connected:
+            self.__send(_KIND.pack(DISCONNECT))
+        self.id = None
+        self.socket.close()
@@ -9,6 +9,20 @@ except ImportError:
 
 from Utils import win
 
+_BOOLEANS = {'1': True, 'true': True, 'yes': True, 'on': True, '#t': True,
+             '0': False, 'false': False, 'no': False, 'off': False, '#f': False}
+
+
+def to_bool(value):
+    """Bool of an option value, strings are read the way config.ini and prc files write them"""
+    if isinstance(value, str):
+        try:
+            return _BOOLEANS[value.strip().lower()]
+        except KeyError:
+            raise ValueError('Not a boolean: {!r}'.format(value))
+
+    return bool(value)
+
 
 class Options:
     __path = ''
@@ -38,6 +52,20 @@ class Options:
     mouse_sensitivity = 35
     invert_mouse = 0
 
+    physics_thread = 0  # doPhysics keeps the GIL, so the worker does not run beside the frame, see World
+    # None leaves value of prc, see PhysicsConfig
+    physics_tick_rate = None
+    physics_max_substeps = None
+    physics_broadphase = None
+    physics_world_size = None
+    physics_solver_iterations = None
+    physics_deactivation = None
+    physics_linear_sleep = None
+    physics_angular_sleep = None
+    physics_lod_near = None
+    physics_lod_far = None
+    physics_lod_divisor = None
+
     @classmethod
     def load(cls, file):
         cls.win_size = '{} {}'.format(base.pipe.getDisplayWidth(), base.pipe.getDisplayHeight())
@@ -56,6 +84,8 @@ class Options:
 
                 if val.isdigit():
                     val = int(val)
+                elif not isinstance(getattr(cls, name), str) and val.strip().lower() in _BOOLEANS:
+                    val = to_bool(val)
 
                 setattr(cls, name, val)
 
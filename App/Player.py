@@ -3,16 +3,22 @@
 from panda3d.core import Vec3
 from direct.showbase.DirectObject import DirectObject
 from direct.showbase.InputStateGlobal import inputState
+from direct.stdpy import threading
 
 from Utils import win
+from App import Stats
 from App.Options import Options
 from App.Characters import Dummy
 
 
 class Controller(DirectObject):
-    def __init__(self, char):
+    def __init__(self, char, lock=None):
+        """
+        :param lock: lock of the World the character is in, noclip swaps characters under it
+        """
         DirectObject.__init__(self)
 
+        self.lock = lock or threading.RLock()
         self.__noclip = False
         self.camera = None  # TODO use for sniper zoom
         self.dummy = Dummy()
@@ -112,13 +118,16 @@ class Controller(DirectObject):
     def noclip(self):
         """base.scene.player.noclip()"""
 
-        self.__noclip = not self.__noclip
+        with self.lock:  # tick callbacks of a threaded world read char
+            self.__noclip = not self.__noclip
 
-        if self.__noclip:
-            self.dummy.setHpr(self.char.getHpr())
-            self.dummy.setPos(self.char.getPos())
+            if self.__noclip:
+                self.dummy.setHpr(self.char.getHpr())
+                self.dummy.setPos(self.char.getPos())
 
-        self.dummy, self.char = self.char, self.dummy
+            self.dummy, self.char = self.char, self.dummy
+            self.dummy.move(Vec3(0))  # left one keeps still
+            self.dummy.turn(0)
         self.unbind_keys()
         self.bind_keys()
 
@@ -175,7 +184,9 @@ class Camera(DirectObject):
         return delta
 
     def __update(self, task):
+        Stats.camera.start()
         self.controller.update()
+        Stats.camera.stop()
 
         return task.cont
 
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+"""PStats collectors of gameplay subsystems
+
+Run pstats server and press F2 (or set want-pstats 1 in prc) to see them.
+Timers are started and stopped around the code, counters are levels set on every physics tick.
+"""
+
+from panda3d.core import PStatClient, PStatCollector
+
+physics_step = PStatCollector('App:Physics:Step')
+physics_contacts = PStatCollector('App:Physics:Contact index')
+characters = PStatCollector('App:Characters')
+kcc_contacts = PStatCollector('App:Characters:Contacts')
+kcc_penetration = PStatCollector('App:Characters:Penetration')
+camera = PStatCollector('App:Camera')
+char_marks = PStatCollector('App:Char marks')
+bonfire = PStatCollector('App:Bonfire')
+
+raycasts = PStatCollector('Physics:Raycasts')
+manifolds = PStatCollector('Physics:Manifolds')
+bodies = PStatCollector('Physics:Bodies')
+active_bodies = PStatCollector('Physics:Bodies:Active')
+
+
+def count_world(world):
+    """Set counters of the tick, bodies are walked only while the client is connected"""
+    raycasts.setLevel(0)
+    manifolds.setLevel(world.getNumManifolds())
+
+    if PStatClient.isConnected():
+        nodes = world.getRigidBodies()
+        bodies.setLevel(len(nodes) + world.getNumGhosts())
+        active_bodies.setLevel(sum(1 for node in nodes if node.isActive()))
+
+
+def toggle():
+    if PStatClient.isConnected():
+        PStatClient.disconnect()
+    else:
+        PStatClient.connect()
+
+
+def connect_worker(connect):
+    """Called in a worker process, so its collectors show up as one more client"""
+    if connect and not PStatClient.isConnected():
+        PStatClient.connect()
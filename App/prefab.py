@@ -6,6 +6,7 @@ from direct.particles.ParticleEffect import ParticleEffect
 from panda3d.core import PointLight, Texture
 
 from Utils.format import hex_to_rgb
+from App import Stats
 
 
 def skybox(texture):
@@ -54,6 +55,7 @@ class Bonfire:
         base.taskMgr.add(self.light_pos_task, 'bonfire_light_pos')
 
     def light_pos_task(self, task):
+        Stats.bonfire.start()
         cx, cy, cz = self.plnp.getPos()
 
         if task.frame % 10 == 0:
@@ -67,6 +69,7 @@ class Bonfire:
             self.ld = uniform(-.1, .1)
 
         self.plight.setColor((self.co[0] + self.ld, self.co[1] + self.ld, self.co[2] + self.ld, self.co[3]))
+        Stats.bonfire.stop()
 
         return task.cont
 
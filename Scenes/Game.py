@@ -2,12 +2,70 @@
 
 from direct.showbase.Audio3DManager import Audio3DManager
 
+from App.Options import Options
+from App.Physics import World
 from Scenes.BaseScene import BaseScene
+from Utils import mesher
+from Utils.geom import bullet_map_from
+from Utils.mapGenerators import Cave
 
 
 class Game(BaseScene):
-    def __init__(self, root_node,  mode):
+    levels = {
+        'default': {'generator': Cave, 'width': 128, 'height': 128, 'params': {'steps': 4}, 'seed': 1},
+    }
+
+    def __init__(self, root_node, mode, level):
+        """
+        :param Dict level: result of mapGenerators.build
+        """
+        BaseScene.__init__(self)
+
         self.root_node = root_node.attachNewNode('Game')
         self.mode = mode
 
+        self.matrix = level['grid']
+        self.level = mesher.model_from_chunks(level['mesh'], 'Level')
+        self.level.reparentTo(self.root_node)
+
+        self.physics = World(threaded=Options.physics_thread)
+        self.physics.node.reparentTo(self.root_node)
+        self.collision = self.collision_for(mode, level)
+        self.collision.reparentTo(self.root_node)
+        for body in self.collision.getChildren():
+            self.physics.attach_body(body.node())
+
         base.audio3d = Audio3DManager(base.sfxManagerList[0], camera)
+
+        self.resume()
+
+    @classmethod
+    def level_for(cls, mode):
+        """Keyword arguments for mapGenerators.build"""
+        return cls.levels.get(mode, cls.levels['default'])
+
+    @classmethod
+    def collision_for(cls, mode, level):
+        """Static bodies of a level built for the mode, sized by the mesh params its walls were drawn with"""
+        mesh_params = cls.level_for(mode).get('mesh_params') or {}
+
+        return bullet_map_from(level['collision'], level['grid'].width, level['grid'].height, **mesh_params)
+
+    def resume(self):
+        BaseScene.resume(self)
+        base.taskMgr.add(self.__update, 'update_scene')
+
+    def pause(self):
+        BaseScene.pause(self)
+        base.taskMgr.remove('update_scene')
+
+    def __update(self, task):
+        self.physics.update(globalClock.getDt())
+
+        return task.cont
+
+    def destroy(self):
+        BaseScene.destroy(self)
+        base.taskMgr.remove('update_scene')
+        self.physics.destroy()
+        self.root_node.removeNode()
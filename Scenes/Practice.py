@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 from math import *
 
 from panda3d.core import Vec3, BitMask32, DirectionalLight
@@ -8,9 +9,10 @@ from panda3d.bullet import BulletRigidBodyNode, BulletSphereShape, BulletBoxShap
 from direct.gui.OnscreenText import OnscreenText
 
 from Utils.format import hex_to_rgb
-from Utils.geom import bullet_shape_from
+from Utils.geom import ShapeCache
 from App import prefab, Gui
-from App.Characters import Character
+from App.Characters import Character, CharacterManager
+from App.Options import Options
 from App.Physics import World
 from Scenes.BaseScene import BaseScene
 from App.Player import Controller, Camera
@@ -25,31 +27,37 @@ class Practice(BaseScene):
 
         self.skybox = prefab.skybox('maps/practice/tex/sea')
 
-        self.physics = World()
+        self.physics = World(threaded=Options.physics_thread)
         self.physics.node.reparentTo(self.root_node)
 
-        self.player = Controller(Character(self.physics.world, self.root_node, get_active_hero()))
+        self.characters = CharacterManager(self.physics)
+        self.player = Controller(Character(self.physics, self.root_node, get_active_hero()), self.physics.lock)
+        self.characters.add(self.player.char)
         self.camera = Camera(self.player, base.camera)
         self.player.set_camera(self.camera)
         self.player.char.setPos(0, -1, 5)
         # self.player.char.body.up = Vec3(-1, 0, 0)
         # self.player.char.body.node.setR(-180)
 
-        # self.enemy = AiController(Character(self.physics.world, self.root_node, make_enemy()))
+        # self.enemy = AiController(Character(self.physics, self.root_node, make_enemy()))
 
         self.char_marks = Gui.CharMarks()
         self.hud = Gui.HUD()
 
+        self.physics.add_tick_callback(self.__tick)
+
         self.load_scene()
         self.resume()
 
     def destroy(self):
         BaseScene.destroy(self)
+        self.physics.destroy()
         self.char_marks.destroy()
         self.hud.destroy()
         self.root_node.removeNode()
         self.skybox.removeNode()
         self.player.destroy()
+        self.characters.destroy()
 
     def resume(self):
         BaseScene.resume(self)
@@ -60,21 +68,16 @@ class Practice(BaseScene):
         base.taskMgr.remove('update_scene')
 
     def __update(self, task):
-        dt = globalClock.getDt()
-        self.physics.update(dt)
-        self.player.char.update(dt)
+        self.physics.update(globalClock.getDt())
 
         return task.cont
 
+    def __tick(self, dt):
+        if self.player.char not in self.characters:  # noclip camera
+            self.player.char.update(dt)
+
     def load_scene(self):
-        # ground
-        sandbox = loader.loadModel('maps/practice/sandbox')
-        np = self.root_node.attachNewNode(BulletRigidBodyNode('Mesh'))
-        np.node().addShape(bullet_shape_from(sandbox))
-        np.setPos(0, 0, 0)
-        np.setCollideMask(BitMask32.allOn())
-        self.physics.world.attachRigidBody(np.node())
-        sandbox.reparentTo(np)
+        props = load_props(self.physics, self.root_node, os.path.join(base.get_user_dir(), 'cache', 'shapes'))
 
         moon = DirectionalLight('moon')
         moon.setColor(hex_to_rgb('ffffff'))
@@ -92,52 +95,73 @@ class Practice(BaseScene):
         moon_np.lookAt(0, 0, 0)
         self.root_node.setLight(moon_np)
 
-        # dynamic sphere
-        np = self.root_node.attachNewNode(BulletRigidBodyNode('Sphere'))
-        np.node().addShape(BulletSphereShape(1))
-        np.node().setMass(3.0)
-        np.setPos(5, 5, 2)
-        self.physics.world.attachRigidBody(np.node())
-
-        ball = loader.loadModel('geometry/ball')
-        ball.reparentTo(np)
-
-        self.char_marks.add('ball', ball, OnscreenText(text='sphere', scale=0.07), 1)
-
-        # dynamic box
-        np = self.root_node.attachNewNode(BulletRigidBodyNode('Box'))
-        np.node().addShape(BulletBoxShape(Vec3(0.5, 0.5, 0.5)))
-        np.node().setMass(1.0)
-        np.setPos(-1, -2, 2)
-        self.physics.world.attachRigidBody(np.node())
-
-        np.node().applyCentralImpulse((0, 2, 7))
-
-        box = loader.loadModel('geometry/box')
-        box.reparentTo(np)
-
-        self.char_marks.add('box', box, OnscreenText(text='cube', scale=0.06), 0.5)
-
-        # static
-        np = self.root_node.attachNewNode(BulletRigidBodyNode('Static'))
-        np.node().addShape(BulletBoxShape(Vec3(0.5, 0.5, 0.5)))
-        np.setPos(1, 2, 0.8)
-        self.physics.world.attachRigidBody(np.node())
-
-        box = loader.loadModel('geometry/box')
-        box.reparentTo(np)
-
-        def move_box(task):
-            angle_degrees = task.time * 12.0
-            if angle_degrees > 360:
-                angle_degrees -= 360
-
-            angle_radians = angle_degrees * (pi / 180)
-            np.setPos(5 * sin(angle_radians), -5 * cos(angle_radians), .5)
-            np.setHpr(angle_degrees, 4, 0)
-
-            return task.cont
-
-        base.taskMgr.add(move_box, 'move_box')
-
-        self.char_marks.add('static', box, OnscreenText(text='static', scale=0.08), 0.5)
+        self.char_marks.add('ball', props['sphere'][1], OnscreenText(text='sphere', scale=0.07), 1)
+        self.char_marks.add('box', props['box'][1], OnscreenText(text='cube', scale=0.06), 0.5)
+        self.char_marks.add('static', props['static'][1], OnscreenText(text='static', scale=0.08), 0.5)
+
+
+def load_props(world, parent, cache_dir=None, models=True):
+    """Bodies of the practice map, shared by the scene and headless simulation
+    Ground model is loaded anyway, its collision is made of it.
+    :param App.Physics.World world:
+    :param Str cache_dir: directory of ShapeCache
+    :param Bool models: attach models to props
+    :return: dict of name: (body NodePath, model NodePath or None)
+    """
+    props = {}
+
+    def model(path, np):
+        if not models:
+            return None
+
+        result = loader.loadModel(path)
+        result.reparentTo(np)
+        return result
+
+    # ground
+    sandbox = loader.loadModel('maps/practice/sandbox')
+    np = parent.attachNewNode(BulletRigidBodyNode('Mesh'))
+    for shape, transform in ShapeCache(cache_dir).proxies(sandbox):
+        np.node().addShape(shape, transform)
+    np.setPos(0, 0, 0)
+    np.setCollideMask(BitMask32.allOn())
+    world.attach_body(np.node())
+    if models:
+        sandbox.reparentTo(np)
+    props['ground'] = np, sandbox if models else None
+
+    # dynamic sphere
+    np = parent.attachNewNode(BulletRigidBodyNode('Sphere'))
+    np.node().addShape(BulletSphereShape(1))
+    np.node().setMass(3.0)
+    np.setPos(5, 5, 2)
+    world.attach_body(np.node())
+    props['sphere'] = np, model('geometry/ball', np)
+    world.track(np, props['sphere'][1])
+
+    # dynamic box
+    np = parent.attachNewNode(BulletRigidBodyNode('Box'))
+    np.node().addShape(BulletBoxShape(Vec3(0.5, 0.5, 0.5)))
+    np.node().setMass(1.0)
+    np.setPos(-1, -2, 2)
+    world.attach_body(np.node())
+    np.node().applyCentralImpulse((0, 2, 7))
+    props['box'] = np, model('geometry/box', np)
+    world.track(np, props['box'][1])
+
+    # static, moved around on physics ticks
+    static = parent.attachNewNode(BulletRigidBodyNode('Static'))
+    static.node().addShape(BulletBoxShape(Vec3(0.5, 0.5, 0.5)))
+    static.setPos(1, 2, 0.8)
+    world.attach_body(static.node())
+    props['static'] = static, model('geometry/box', static)
+
+    def move_static(dt):
+        angle_degrees = (world.ticks + 1) * world.tick_dt * 12.0 % 360
+        angle_radians = angle_degrees * (pi / 180)
+        static.setPos(5 * sin(angle_radians), -5 * cos(angle_radians), .5)
+        static.setHpr(angle_degrees, 4, 0)
+
+    world.add_tick_callback(move_static)
+
+    return props
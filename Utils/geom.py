@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 
-from panda3d.core import LVector3
-from panda3d.bullet import BulletTriangleMeshShape, BulletTriangleMesh
+import os
+import hashlib
+
+from panda3d.core import LVector3, Vec3, Point3, NodePath, TransformState, BitMask32, BamFile, Filename, \
+    VirtualFileSystem, GeomVertexReader
+from panda3d.bullet import BulletTriangleMeshShape, BulletTriangleMesh, BulletRigidBodyNode, BulletBoxShape, \
+    BulletPlaneShape, BulletConvexHullShape, BulletSphereShape
+
+COLLISION_TAG = 'collision'
+PROXY_KINDS = ('auto', 'box', 'sphere', 'hull', 'mesh', 'none')
 
 
 def normalized(*args):
@@ -21,3 +29,313 @@ def bullet_shape_from(source, dynamic=False):
             mesh.addGeom(geom, True, ts)
 
     return BulletTriangleMeshShape(mesh, dynamic=dynamic)
+
+
+def geom_triangles(geom_node, relative_to):
+    """Triangles of GeomNode as tuples of 3 points in space of relative_to"""
+    mat = geom_node.getMat(relative_to)
+    triangles = []
+
+    for geom in geom_node.node().getGeoms():
+        reader = GeomVertexReader(geom.getVertexData(), 'vertex')
+        points = []
+        while not reader.isAtEnd():
+            points.append(mat.xformPoint(reader.getData3()))
+
+        for prim in geom.getPrimitives():
+            prim = prim.decompose()
+            for i in range(prim.getNumPrimitives()):
+                start = prim.getPrimitiveStart(i)
+                triangles.append(tuple(points[prim.getVertex(start + k)] for k in range(3)))
+
+    return triangles
+
+
+def connected_parts(triangles, precision=3):
+    """Split triangles into groups sharing vertices, positions are compared rounded to precision"""
+    parent = list(range(len(triangles)))
+    owners = {}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, triangle in enumerate(triangles):
+        for p in triangle:
+            key = round(p.x, precision), round(p.y, precision), round(p.z, precision)
+            if key in owners:
+                parent[find(i)] = find(owners[key])
+            else:
+                owners[key] = i
+
+    parts = {}
+    for i, triangle in enumerate(triangles):
+        parts.setdefault(find(i), []).append(triangle)
+
+    return list(parts.values())
+
+
+def is_closed(triangles, precision=3):
+    """Every edge is shared by exactly two triangles, so the part encloses a volume
+    Open parts (flat quads, arches, domes) would collide as solids when turned into a box or a hull.
+    """
+    edges = {}
+
+    for triangle in triangles:
+        keys = [(round(p.x, precision), round(p.y, precision), round(p.z, precision)) for p in triangle]
+        for i in range(3):
+            a, b = keys[i], keys[i - 1]
+            if a != b:
+                edge = (a, b) if a < b else (b, a)
+                edges[edge] = edges.get(edge, 0) + 1
+
+    return all(count == 2 for count in edges.values())
+
+
+def is_convex(triangles, tolerance=0.02):
+    """No vertex lies in front of any face plane"""
+    points = [p for triangle in triangles for p in triangle]
+
+    for a, b, c in triangles:
+        normal = (b - a).cross(c - a)
+        if normal.lengthSquared() < 1e-12:
+            continue
+        normal.normalize()
+
+        if max(normal.dot(p - a) for p in points) > tolerance:
+            return False
+
+    return True
+
+
+def bounds_of(triangles):
+    points = [p for triangle in triangles for p in triangle]
+    low = Point3(*(min(p[i] for p in points) for i in range(3)))
+    high = Point3(*(max(p[i] for p in points) for i in range(3)))
+
+    return low, high
+
+
+def is_box(triangles, tolerance=0.02):
+    """Convex part with every vertex in a corner of its bounds, so a box shape is exact for it"""
+    low, high = bounds_of(triangles)
+
+    for triangle in triangles:
+        for p in triangle:
+            if any(abs(p[i] - low[i]) > tolerance and abs(p[i] - high[i]) > tolerance for i in range(3)):
+                return False
+
+    return is_convex(triangles, tolerance)
+
+
+def _box(triangles):
+    low, high = bounds_of(triangles)
+
+    return BulletBoxShape((high - low) / 2), TransformState.makePos((low + high) / 2)
+
+
+def _hull(triangles):
+    shape = BulletConvexHullShape()
+    for point in {(p.x, p.y, p.z) for triangle in triangles for p in triangle}:
+        shape.addPoint(Point3(*point))
+
+    return shape
+
+
+def collision_proxies_from(model, default='auto', min_hull=32, tolerance=0.02):
+    """Collision shapes of a static model, fewer contacts for characters than triangles of bullet_shape_from
+    Every GeomNode takes 'collision' tag of itself or its parents, set in egg with <Tag> collision { hull }:
+        box, sphere - bounds of the node, hull - convex hull of its vertices, mesh - its triangles, none - skipped,
+        auto - box for closed box shaped connected parts, hull for other closed convex parts of min_hull triangles
+        and more, triangles for the rest. Small parts stay triangles, a ray through the mesh tree is cheaper than a hull.
+    Triangles of all nodes go to one triangle mesh shape.
+    :param Str default: kind of untagged nodes
+    :return: list of (shape, TransformState)
+    """
+    proxies = []
+    mesh = BulletTriangleMesh()
+    mesh_size = 0
+
+    for geom_node in model.findAllMatches('**/+GeomNode'):
+        kind = geom_node.getNetTag(COLLISION_TAG) or default
+        if kind not in PROXY_KINDS:
+            raise ValueError('Unknown collision proxy: {}'.format(kind))
+        if kind == 'none':
+            continue
+
+        triangles = geom_triangles(geom_node, model)
+        if not triangles:
+            continue
+
+        if kind == 'box':
+            proxies.append(_box(triangles))
+        elif kind == 'sphere':
+            points = [p for triangle in triangles for p in triangle]
+            center = Point3(sum((Vec3(p) for p in points), Vec3()) / len(points))
+            radius = max((p - center).length() for p in points)
+            proxies.append((BulletSphereShape(radius), TransformState.makePos(center)))
+        elif kind == 'hull':
+            proxies.append((_hull(triangles), TransformState.makeIdentity()))
+        else:
+            parts = [triangles] if kind == 'mesh' else connected_parts(triangles)
+            for part in parts:
+                if kind == 'auto' and is_closed(part):
+                    if is_box(part, tolerance):
+                        proxies.append(_box(part))
+                        continue
+                    if len(part) >= min_hull and is_convex(part, tolerance):
+                        proxies.append((_hull(part), TransformState.makeIdentity()))
+                        continue
+
+                for triangle in part:
+                    mesh.addTriangle(*triangle)
+                mesh_size += len(part)
+
+    if mesh_size:
+        proxies.append((BulletTriangleMeshShape(mesh, dynamic=False), TransformState.makeIdentity()))
+
+    return proxies
+
+
+class ShapeCache:
+    """ShapeCache(os.path.join(base.get_user_dir(), 'cache', 'shapes'))
+    Collision shapes of loaded models by file path and modification time.
+    Shapes are shared by every cache instance and stored as bam files, so later runs skip walking model geoms.
+    """
+
+    version = 3
+    shapes = {}
+
+    def __init__(self, path=None):
+        """
+        :param Str path: directory for bam files, shapes are kept only in memory without it
+        """
+        self.path = path
+
+        if path is not None and not os.path.exists(path):
+            os.makedirs(path)
+
+    @classmethod
+    def key(cls, model, *extra):
+        """Hash of file path, its modification time and extra, None if model is not loaded from a file"""
+        node = model.node()
+        if not hasattr(node, 'getFullpath') or node.getFullpath().empty():
+            return None
+
+        fullpath = node.getFullpath()
+        file = VirtualFileSystem.getGlobalPtr().getFile(fullpath)
+        timestamp = file.getTimestamp() if file is not None else 0
+        data = ' '.join(str(value) for value in (cls.version, fullpath, timestamp) + extra)
+
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def file(self, key):
+        return Filename.fromOsSpecific(os.path.join(self.path, key + '.bam'))
+
+    def get(self, model, dynamic=False):
+        """Triangle mesh shape of the model, built with bullet_shape_from only when neither memory nor disk has it
+        :param NodePath model: result of loader.loadModel
+        """
+        key = self.key(model, 'mesh', bool(dynamic))
+        if key is None:
+            return bullet_shape_from(model, dynamic)
+
+        return self.__cached(key, lambda: [(bullet_shape_from(model, dynamic), TransformState.makeIdentity())])[0][0]
+
+    def proxies(self, model, default='auto'):
+        """Result of collision_proxies_from, cached the same way"""
+        key = self.key(model, 'proxies', default)
+        if key is None:
+            return collision_proxies_from(model, default)
+
+        return self.__cached(key, lambda: collision_proxies_from(model, default))
+
+    def __cached(self, key, build):
+        shapes = self.shapes.get(key)
+        if shapes is None:
+            shapes = self.load(key)
+            if shapes is None:
+                shapes = build()
+                self.save(key, shapes)
+            self.shapes[key] = shapes
+
+        return shapes
+
+    def load(self, key):
+        """List of (shape, transform) read from the body stored in bam file"""
+        if self.path is None or not os.path.exists(self.file(key).toOsSpecific()):
+            return None
+
+        bam = BamFile()
+        if not bam.openRead(self.file(key)):
+            return None
+
+        body = bam.readObject()
+        bam.resolve()
+        bam.close()
+
+        if not isinstance(body, BulletRigidBodyNode):
+            return None
+
+        return [(body.getShape(i), body.getShapeTransform(i)) for i in range(body.getNumShapes())]
+
+    def save(self, key, shapes):
+        if self.path is None:
+            return
+
+        body = BulletRigidBodyNode('shapes')
+        for shape, transform in shapes:
+            body.addShape(shape, transform)
+
+        tmp = Filename(self.file(key).getFullpath() + '.tmp')
+        bam = BamFile()
+        if not bam.openWrite(tmp):
+            return
+        bam.writeObject(body)
+        bam.close()
+        os.replace(tmp.toOsSpecific(), self.file(key).toOsSpecific())
+
+
+def bullet_map_from(chunks, width, height, wall_height=3.0, cell_size=1.0, floor=True, ceiling=False, bounds=True):
+    """Static bodies for a map made from mesher.box_chunks
+    Every chunk is one body with a box per wall rectangle, so bullet works with a few boxes instead of triangles.
+    Map edge is closed with 4 boxes, as mesher treats cells out of the map as walls.
+    Takes the same mesh params as mesher, so collision matches the drawn walls.
+    :return: NodePath with a BulletRigidBodyNode for every chunk, floor, ceiling and bounds
+    """
+    root = NodePath('Collision')
+    s = cell_size
+    h = wall_height / 2
+
+    def box(body, x, y, end_x, end_y):
+        shape = BulletBoxShape(Vec3((end_x - x) * s / 2, (end_y - y) * s / 2, h))
+        body.addShape(shape, TransformState.makePos(Point3((x + end_x) * s / 2, (y + end_y) * s / 2, h)))
+
+    for cx, cy, rects in chunks:
+        body = BulletRigidBodyNode('chunk {} {}'.format(cx, cy))
+        for rect in rects:
+            box(body, *rect)
+        root.attachNewNode(body)
+
+    if floor:
+        body = BulletRigidBodyNode('Floor')
+        body.addShape(BulletPlaneShape(Vec3(0, 0, 1), 0))
+        root.attachNewNode(body)
+
+    if ceiling:
+        body = BulletRigidBodyNode('Ceiling')
+        body.addShape(BulletPlaneShape(Vec3(0, 0, -1), -wall_height))
+        root.attachNewNode(body)
+
+    if bounds:
+        body = BulletRigidBodyNode('Bounds')
+        for rect in ((-1, -1, width + 1, 0), (-1, height, width + 1, height + 1), (-1, 0, 0, height),
+                     (width, 0, width + 1, height)):
+            box(body, *rect)
+        root.attachNewNode(body)
+
+    root.setCollideMask(BitMask32.allOn())
+
+    return root
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""Bit packed 2d matrix of booleans"""
+
+import struct
+from itertools import chain
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_TO_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+_BYTE_CELLS = [tuple(bool(b >> i & 1) for i in range(8)) for b in range(256)]
+_HEADER = struct.Struct('<II')
+
+
+def pack_line(cells):
+    """Bit x of result is cells[x], cells are booleans"""
+    if not len(cells):
+        return 0
+
+    return int(bytes(cells[::-1]).translate(_TO_DIGITS), 2)
+
+
+def bit_runs(bits):
+    """Yield (begin, end) of continuous runs of set bits"""
+    starts = bits & ~(bits << 1)
+    ends = bits & ~(bits >> 1)
+
+    while starts:
+        low = starts & -starts
+        starts ^= low
+        high = ends & -ends
+        ends ^= high
+        yield low.bit_length() - 1, high.bit_length()
+
+
+class Grid:
+    """Grid(width, height)
+    Row y takes stride = ceil(width / 8) bytes, cell x is bit x % 8 of byte x // 8.
+    Row is Y and column is X, as in matrix[y][x].
+    """
+
+    __slots__ = ('width', 'height', 'stride', 'data')
+
+    def __init__(self, width, height, data=None):
+        self.width = width
+        self.height = height
+        self.stride = (width + 7) // 8
+        self.data = bytearray(self.stride * height) if data is None else bytearray(data)
+
+        if len(self.data) != self.stride * height:
+            raise ValueError('Data size does not match {}x{} grid'.format(width, height))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """From 2d list with booleans"""
+        rows = list(rows)
+        grid = cls(len(rows[0]) if rows else 0, len(rows))
+
+        for y, row in enumerate(rows):
+            grid.set_row(y, row)
+
+        return grid
+
+    @classmethod
+    def from_row_bits(cls, width, rows):
+        """From list of ints, where bit x is a cell x"""
+        grid = cls(width, len(rows))
+
+        for y, bits in enumerate(rows):
+            grid.set_row_bits(y, bits)
+
+        return grid
+
+    @classmethod
+    def from_numpy(cls, array):
+        height, width = array.shape
+        packed = numpy.packbits(array.astype(bool), axis=1, bitorder='little')
+
+        return cls(width, height, packed.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        width, height = _HEADER.unpack_from(data)
+
+        return cls(width, height, data[_HEADER.size:])
+
+    def to_bytes(self):
+        return _HEADER.pack(self.width, self.height) + bytes(self.data)
+
+    def to_numpy(self):
+        packed = numpy.frombuffer(bytes(self.data), dtype=numpy.uint8).reshape(self.height, self.stride)
+
+        return numpy.unpackbits(packed, axis=1, bitorder='little')[:, :self.width].astype(bool)
+
+    def to_rows(self):
+        return [self.row(y) for y in range(self.height)]
+
+    def copy(self):
+        return Grid(self.width, self.height, self.data)
+
+    def get(self, x, y):
+        return bool(self.data[y * self.stride + (x >> 3)] >> (x & 7) & 1)
+
+    def set(self, x, y, value):
+        i = y * self.stride + (x >> 3)
+        if value:
+            self.data[i] |= 1 << (x & 7)
+        else:
+            self.data[i] &= ~(1 << (x & 7))
+
+    def fill(self, value):
+        bits = (1 << self.width) - 1 if value else 0
+        for y in range(self.height):
+            self.set_row_bits(y, bits)
+
+    def row(self, y):
+        start = y * self.stride
+        cells = list(chain.from_iterable(_BYTE_CELLS[b] for b in self.data[start:start + self.stride]))
+        del cells[self.width:]
+
+        return cells
+
+    def set_row(self, y, cells):
+        self.set_row_bits(y, pack_line(cells))
+
+    def row_bits(self, y):
+        start = y * self.stride
+
+        return int.from_bytes(self.data[start:start + self.stride], 'little')
+
+    def set_row_bits(self, y, bits):
+        start = y * self.stride
+        self.data[start:start + self.stride] = (bits & ((1 << self.width) - 1)).to_bytes(self.stride, 'little')
+
+    def column(self, x):
+        data, stride, shift = self.data, self.stride, x & 7
+
+        return [bool(data[i] >> shift & 1) for i in range(x >> 3, len(data), stride)]
+
+    def rows(self):
+        return (self.row(y) for y in range(self.height))
+
+    def transposed(self):
+        """Grid where rows are columns of this one"""
+        if numpy is not None:
+            return Grid.from_numpy(self.to_numpy().T)
+
+        return Grid.from_row_bits(self.height, [pack_line(self.column(x)) for x in range(self.width)])
+
+    def crop(self, x0, y0, x1, y1):
+        return Grid.from_row_bits(x1 - x0, [self.row_bits(y) >> x0 for y in range(y0, y1)])
+
+    def count(self):
+        """Number of True cells"""
+        return sum(bin(b).count('1') for b in self.data)
+
+    def count_neighbours(self, x, y, border=True):
+        """Number of True cells around the cell, cells out of the grid count as border"""
+        count = 0
+
+        for j in range(y - 1, y + 2):
+            for i in range(x - 1, x + 2):
+                if i == x and j == y:
+                    continue
+                if i < 0 or j < 0 or i >= self.width or j >= self.height:
+                    count += border
+                elif self.data[j * self.stride + (i >> 3)] >> (i & 7) & 1:
+                    count += 1
+
+        return count
+
+    def neighbour_counts(self, border=True):
+        """Bit sliced neighbour counts for all rows at once
+        Yields (row_bits, planes) for each row, bit x of planes[i] is bit i of neighbour count of cell x
+        """
+        width = self.width
+        mask = (1 << width) - 1
+        edge = (1 | 1 << (width + 1)) if border else 0
+        outside = ((mask << 1) | edge) if border else 0
+
+        lines = [(self.row_bits(y) << 1) | edge for y in range(self.height)]
+
+        for y in range(self.height):
+            up = lines[y - 1] if y > 0 else outside
+            down = lines[y + 1] if y + 1 < self.height else outside
+            line = lines[y]
+
+            s0 = s1 = s2 = s3 = 0
+            for v in (up, up >> 1, up >> 2, line, line >> 2, down, down >> 1, down >> 2):
+                v &= mask
+                c0 = s0 & v
+                s0 ^= v
+                c1 = s1 & c0
+                s1 ^= c0
+                c2 = s2 & c1
+                s2 ^= c1
+                s3 |= c2
+
+            yield line >> 1 & mask, (s0, s1, s2, s3)
+
+    def __iter__(self):
+        return self.rows()
+
+    def __len__(self):
+        return self.height
+
+    def __eq__(self, other):
+        if isinstance(other, Grid):
+            return self.width == other.width and self.height == other.height and self.data == other.data
+
+        return self.to_rows() == other
+
+    def __repr__(self):
+        return 'Grid({}x{})'.format(self.width, self.height)
+
+
+def count_at_least(planes, limit, mask):
+    """Bits of cells whose bit sliced count is >= limit"""
+    result = 0
+
+    for value in range(max(limit, 0), 9):
+        bits = mask
+        for i, plane in enumerate(planes):
+            bits &= plane if value >> i & 1 else ~plane
+        result |= bits
+
+    return result
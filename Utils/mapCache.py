@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""Generated maps stored on disk with data derived from them
+
+Every map is one zlib compressed file of named sections:
+    'grid' - Grid.to_bytes()
+    'mesh' - chunks made by mesher.mesh_chunks
+    'collision' - wall rectangles made by mesher.box_chunks
+"""
+
+import os
+import json
+import zlib
+import struct
+import hashlib
+from array import array
+
+from Utils.grid import Grid
+
+_MAGIC = b'DGMC'
+_LENGTH = struct.Struct('<I')
+_CHUNK = struct.Struct('<iiII')
+_RECTS = struct.Struct('<iiI')
+_RECT = struct.Struct('<IIII')
+
+
+def pack_chunks(chunks):
+    parts = [_LENGTH.pack(len(chunks))]
+
+    for cx, cy, vertices, indices in chunks:
+        parts.append(_CHUNK.pack(cx, cy, len(vertices), len(indices)))
+        parts.append(vertices.tobytes())
+        parts.append(indices.tobytes())
+
+    return b''.join(parts)
+
+
+def unpack_chunks(data):
+    count, = _LENGTH.unpack_from(data)
+    offset = _LENGTH.size
+    chunks = []
+
+    for _ in range(count):
+        cx, cy, num_vertices, num_indices = _CHUNK.unpack_from(data, offset)
+        offset += _CHUNK.size
+
+        vertices = array('f')
+        vertices.frombytes(data[offset:offset + num_vertices * vertices.itemsize])
+        offset += num_vertices * vertices.itemsize
+
+        indices = array('I')
+        indices.frombytes(data[offset:offset + num_indices * indices.itemsize])
+        offset += num_indices * indices.itemsize
+
+        chunks.append((cx, cy, vertices, indices))
+
+    return chunks
+
+
+def pack_rects(chunks):
+    parts = [_LENGTH.pack(len(chunks))]
+
+    for cx, cy, rects in chunks:
+        parts.append(_RECTS.pack(cx, cy, len(rects)))
+        parts.extend(_RECT.pack(*rect) for rect in rects)
+
+    return b''.join(parts)
+
+
+def unpack_rects(data):
+    count, = _LENGTH.unpack_from(data)
+    offset = _LENGTH.size
+    chunks = []
+
+    for _ in range(count):
+        cx, cy, num_rects = _RECTS.unpack_from(data, offset)
+        offset += _RECTS.size
+
+        rects = list(_RECT.iter_unpack(data[offset:offset + num_rects * _RECT.size]))
+        offset += num_rects * _RECT.size
+
+        chunks.append((cx, cy, rects))
+
+    return chunks
+
+
+class MapCache:
+    """MapCache(os.path.join(base.get_user_dir(), 'cache', 'maps'))"""
+
+    version = 2
+    packers = {
+        'grid': (Grid.to_bytes, Grid.from_bytes),
+        'mesh': (pack_chunks, unpack_chunks),
+        'collision': (pack_rects, unpack_rects),
+    }
+
+    def __init__(self, path):
+        self.path = path
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    @classmethod
+    def key(cls, generator, width, height, params, seed, **extra):
+        """Hash of everything the map depends on"""
+        data = json.dumps([cls.version, generator.__name__, width, height, params, seed, extra], sort_keys=True)
+
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def file(self, key):
+        return os.path.join(self.path, key + '.map')
+
+    def load(self, key):
+        """Dict of sections or None if map is not cached"""
+        try:
+            with open(self.file(key), 'rb') as file:
+                data = zlib.decompress(file.read())
+        except (OSError, zlib.error):
+            return None
+
+        if data[:len(_MAGIC)] != _MAGIC:
+            return None
+
+        sections = {}
+        offset = len(_MAGIC)
+        while offset < len(data):
+            name_len, = _LENGTH.unpack_from(data, offset)
+            name = data[offset + _LENGTH.size:offset + _LENGTH.size + name_len].decode()
+            offset += _LENGTH.size + name_len
+
+            size, = _LENGTH.unpack_from(data, offset)
+            payload = data[offset + _LENGTH.size:offset + _LENGTH.size + size]
+            offset += _LENGTH.size + size
+
+            if name in self.packers:
+                sections[name] = self.packers[name][1](payload)
+
+        return sections
+
+    def save(self, key, sections):
+        parts = [_MAGIC]
+
+        for name, value in sections.items():
+            if name not in self.packers:
+                continue
+
+            payload = self.packers[name][0](value)
+            encoded = name.encode()
+            parts += [_LENGTH.pack(len(encoded)), encoded, _LENGTH.pack(len(payload)), payload]
+
+        tmp = self.file(key) + '.tmp'
+        with open(tmp, 'wb') as file:
+            file.write(zlib.compress(b''.join(parts)))
+        os.replace(tmp, self.file(key))
@@ -1,7 +1,25 @@
 #!/usr/bin/env python3
 
+import os
+import sys
 import random
 import abc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from panda3d.core import NodePath, GeomNode, PStatCollector
+
+if __name__ == '__main__' and not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # run as a script
+
+from Utils import mesher, regions
+from Utils.grid import Grid, count_at_least
+from Utils.mapCache import MapCache
 
 
 class GetOutOfLoop(Exception):
@@ -21,87 +39,317 @@ class Map:
 
     @abc.abstractmethod
     def generate(self, **kwargs):
-        """Generate 2d list with booleans"""
+        """Generate Grid with booleans, True is a wall"""
         pass
 
-    @abc.abstractmethod
-    def get_model(self):
-        """Make 3d vertexes for this map"""
-        pass
+    def get_model(self, chunk_size=64, wall_height=3.0, cell_size=1.0, floor=True, ceiling=False):
+        """Greedy meshed walls and floor, one Geom per chunk"""
+        return mesher.make_model(self.matrix, type(self).__name__, chunk_size, wall_height=wall_height,
+                                 cell_size=cell_size, floor=floor, ceiling=ceiling)
 
 
 class Cave(Map):
-    def generate(self, birth_limit=4, death_limit=3, initial_chance=0.4, steps=3):
-        self.matrix = [[random.random() < initial_chance for x in range(self.width)] for y in range(self.height)]
+    backends = ('python', 'numpy')
 
-        for _ in range(steps):
-            step_map = [[False for x in range(self.width)] for y in range(self.height)]
+    def generate(self, birth_limit=4, death_limit=3, initial_chance=0.4, steps=3, backend='python', seed=None,
+                 cleanup=None, min_region=0, progress=None):
+        """Cellular automaton cave, alive cells are walls
+        :param Str backend: 'python' or 'numpy', both return the same matrix for the same seed
+        :param seed: the same seed makes the same cave, None uses global random state
+        :param Str cleanup: None, 'fill' or 'connect' unreachable pockets, see regions.cleanup
+        :param Int min_region: pockets smaller than this are always filled
+        :param Callable progress: called with (stage, done, total) after each step
+        """
+        rnd = random if seed is None else random.Random(seed)
 
-            for y, row in enumerate(self.matrix):
-                for x, cell in enumerate(row):
-                    count = self.count_alive_neighbours(x, y)
+        self.matrix = Grid(self.width, self.height)
+        for y in range(self.height):
+            self.matrix.set_row(y, [rnd.random() < initial_chance for x in range(self.width)])
 
-                    if self.matrix[y][x]:
-                        if count < death_limit:
-                            step_map[y][x] = False
-                        else:
-                            step_map[y][x] = True
-                    else:
-                        if count > birth_limit:
-                            step_map[y][x] = True
-                        else:
-                            step_map[y][x] = False
+        self.evolve(birth_limit, death_limit, steps, backend, progress)
 
-            self.matrix = step_map
+        if cleanup is not None:
+            regions.cleanup(self.matrix, cleanup, min_region)
+            if progress is not None:
+                progress('Cleaning', 1, 1)
 
         return self.matrix
 
+    def evolve(self, birth_limit=4, death_limit=3, steps=3, backend='python', progress=None):
+        """Run automaton steps over current matrix"""
+        if backend not in self.backends:
+            raise ValueError('Unknown backend: {}'.format(backend))
+
+        if not isinstance(self.matrix, Grid):
+            self.matrix = Grid.from_rows(self.matrix)
+
+        if backend == 'numpy':
+            self.matrix = self.__generate_numpy(birth_limit, death_limit, steps, progress)
+        else:
+            self.__generate_python(birth_limit, death_limit, steps, progress)
+
+        return self.matrix
+
+    def __generate_python(self, birth_limit, death_limit, steps, progress):
+        """Whole rows are processed at once with bit sliced neighbour counts"""
+        mask = (1 << self.width) - 1
+
+        for step in range(steps):
+            rows = []
+            for alive, counts in self.matrix.neighbour_counts():
+                survived = alive & count_at_least(counts, death_limit, mask)
+                born = ~alive & count_at_least(counts, birth_limit + 1, mask)
+                rows.append(survived | born)
+
+            self.matrix = Grid.from_row_bits(self.width, rows)
+
+            if progress is not None:
+                progress('Generating', step + 1, steps)
+
+    def __generate_numpy(self, birth_limit, death_limit, steps, progress):
+        if numpy is None:
+            raise ImportError('numpy backend requires numpy to be installed')
+
+        alive = self.matrix.to_numpy()
+        count = numpy.empty(alive.shape, dtype=numpy.uint8)
+
+        for step in range(steps):
+            padded = numpy.pad(alive, 1, mode='constant', constant_values=True)  # out of border is alive
+            count.fill(0)
+
+            for dy in range(3):
+                for dx in range(3):
+                    if dx != 1 or dy != 1:
+                        count += padded[dy:dy + self.height, dx:dx + self.width]
+
+            alive = numpy.where(alive, count >= death_limit, count > birth_limit)
+
+            if progress is not None:
+                progress('Generating', step + 1, steps)
+
+        return Grid.from_numpy(alive)
+
     def count_alive_neighbours(self, x, y):
-        count = 0
+        return self.matrix.count_neighbours(x, y)
 
-        for i in range(-1, 2):
-            for j in range(-1, 2):
-                neighbour_x = x + i
-                neighbour_y = y + j
 
-                if i == 0 and j == 0:
-                    pass  # self
-                elif neighbour_x < 0 or neighbour_y < 0 \
-                        or neighbour_x == len(self.matrix[0]) or neighbour_y == len(self.matrix):
-                    count = count + 1  # out of border
-                elif self.matrix[neighbour_y][neighbour_x]:
-                    count = count + 1  # alive in matrix
+class ChunkedCave(Map):
+    """Endless cave split into square chunks
+    Every chunk is generated from its own seed. Automaton runs over the chunk with a halo of neighbours' noise,
+    so cells near borders get the same values as if the whole world was generated at once.
+    Only max_chunks recently used chunks are kept in memory.
+    """
 
-        return count
+    def __init__(self, chunk_size=32, max_chunks=256, seed=0):
+        Map.__init__(self, chunk_size, chunk_size)
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.seed = seed
+        self.chunks = OrderedDict()
+        self.rules = {}
+        self.generate()
 
-    def get_model(self):
-        pass
+    def generate(self, birth_limit=4, death_limit=3, initial_chance=0.4, steps=3, backend='python'):
+        """Set automaton rules and forget generated chunks, new ones are made by update()"""
+        if steps + 1 > self.chunk_size:
+            raise ValueError('Chunk size must be greater than automaton steps')
+
+        self.rules = {'birth_limit': birth_limit, 'death_limit': death_limit, 'steps': steps, 'backend': backend}
+        self.initial_chance = initial_chance
+        self.chunks.clear()
+
+        return self
+
+    def chunk_coords(self, x, y):
+        return x // self.chunk_size, y // self.chunk_size
+
+    def update(self, x, y, radius=2):
+        """Make sure chunks around the cell exist, evict least recently used ones
+        :return: (created, evicted) lists of chunk coords
+        """
+        cx, cy = self.chunk_coords(int(x), int(y))
+        if (radius * 2 + 1) ** 2 > self.max_chunks:
+            raise ValueError('max_chunks is too small for radius {}'.format(radius))
+
+        before = set(self.chunks)
+        created = []
+        for j in range(cy - radius, cy + radius + 1):
+            for i in range(cx - radius, cx + radius + 1):
+                if (i, j) not in self.chunks:
+                    created.append((i, j))
+                self.get_chunk(i, j)
+
+        return created, list(before.difference(self.chunks))
+
+    def get_chunk(self, cx, cy):
+        key = (cx, cy)
+
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+        else:
+            self.chunks[key] = self.__generate_chunk(cx, cy)
+            while len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+
+        return self.chunks[key]
+
+    def cell(self, x, y):
+        cx, cy = self.chunk_coords(x, y)
+        return self.get_chunk(cx, cy).matrix.get(x - cx * self.chunk_size + 1, y - cy * self.chunk_size + 1)
+
+    def noise(self, cx, cy):
+        """Initial random matrix of the chunk"""
+        rnd = random.Random('{} {} {}'.format(self.seed, cx, cy))
+        size = self.chunk_size
+        grid = Grid(size, size)
+
+        for y in range(size):
+            grid.set_row(y, [rnd.random() < self.initial_chance for x in range(size)])
+
+        return grid
+
+    def __generate_chunk(self, cx, cy):
+        size = self.chunk_size
+        halo = self.rules['steps'] + 1  # one more ring of cells is kept for meshing
+        x0, y0 = cx * size - halo, cy * size - halo
+        full = size + halo * 2
+
+        noises = {}
+        rows = []
+        for y in range(y0, y0 + full):
+            bits = 0
+            for i in range(cx - 1, cx + 2):
+                key = i, y // size
+                if key not in noises:
+                    noises[key] = self.noise(*key)
+                shift = i * size - x0
+                line = noises[key].row_bits(y - key[1] * size)
+                bits |= line << shift if shift >= 0 else line >> -shift
+            rows.append(bits)
+
+        cave = Cave(full, full)
+        cave.matrix = Grid.from_row_bits(full, rows)
+        cave.evolve(**self.rules)
+        cut = halo - 1
+
+        return Chunk(cx, cy, cave.matrix.crop(cut, cut, full - cut, full - cut))
+
+    def get_model(self, cx, cy, wall_height=3.0, cell_size=1.0, floor=True, ceiling=False):
+        """Model of a single chunk placed in world coordinates"""
+        return self.get_chunk(cx, cy).get_model(self.chunk_size, wall_height, cell_size, floor, ceiling)
+
+
+class Chunk:
+    """Part of ChunkedCave, matrix is a Grid with one extra ring of neighbour cells"""
+
+    def __init__(self, cx, cy, matrix):
+        self.cx = cx
+        self.cy = cy
+        self.matrix = matrix
+
+    def get_model(self, size, wall_height=3.0, cell_size=1.0, floor=True, ceiling=False):
+        rows, columns = mesher.pack_lines(self.matrix)
+        vertices, indices = mesher.mesh_arrays(rows, columns, 1, 1, size + 1, size + 1, wall_height=wall_height,
+                                               cell_size=cell_size, floor=floor, ceiling=ceiling)
+
+        model = NodePath(GeomNode('chunk {} {}'.format(self.cx, self.cy)))
+        if indices:
+            model.node().addGeom(mesher.make_geom(vertices, indices))
+        model.setPos((self.cx * size - 1) * cell_size, (self.cy * size - 1) * cell_size, 0)
+
+        return model
 
 
 class Room(Map):
-    def generate(self, **kwargs):
-        pass
+    def generate(self, wall=1, seed=None, progress=None):
+        """Empty room surrounded by walls
+        :param Int wall: wall thickness in cells
+        """
+        self.matrix = Grid(self.width, self.height)
+        inner = ((1 << max(self.width - wall * 2, 0)) - 1) << wall
+        full = (1 << self.width) - 1
 
-    def get_model(self):
-        pass
+        for y in range(self.height):
+            self.matrix.set_row_bits(y, full if y < wall or y >= self.height - wall else full ^ inner)
 
+        if progress is not None:
+            progress('Generating', 1, 1)
 
-class Arena(Map):
-    def generate(self, **kwargs):
-        pass
+        return self.matrix
 
-    def get_model(self):
-        pass
+
+class Arena(Room):
+    def generate(self, wall=1, pillar=2, spacing=8, seed=None, progress=None):
+        """Room with a centered grid of square pillars to hide behind"""
+        Room.generate(self, wall)
+
+        def starts(size):
+            inner = size - wall * 2
+            count = max((inner - spacing) // (pillar + spacing), 0)
+            first = wall + (inner - count * (pillar + spacing) + spacing) // 2
+            return range(first, first + count * (pillar + spacing), pillar + spacing)
+
+        for y in starts(self.height):
+            for x in starts(self.width):
+                for j in range(pillar):
+                    for i in range(pillar):
+                        self.matrix.set(x + i, y + j, True)
+
+        if progress is not None:
+            progress('Generating', 1, 1)
+
+        return self.matrix
+
+
+@contextmanager
+def _collect(stage):
+    """PStats timer of a map generation stage"""
+    collector = PStatCollector('App:Map generation:' + stage)
+    collector.start()
+    try:
+        yield
+    finally:
+        collector.stop()
+
+
+def build(generator, width, height, params=None, seed=None, chunk_size=64, mesh_params=None, cache_dir=None,
+          progress=None):
+    """Generate a map and its mesh arrays, picklable so it can run in a worker process
+    Seeded maps are read from cache_dir when possible and stored there otherwise.
+    :param Type generator: Map subclass
+    :return: dict with 'grid', 'mesh' - [(cx, cy, vertices, indices), ...] and 'collision' - [(cx, cy, rects), ...]
+    """
+    params = params or {}
+    mesh_params = mesh_params or {}
+    cache = key = None
+
+    if cache_dir is not None and seed is not None:
+        cache = MapCache(cache_dir)
+        key = cache.key(generator, width, height, params, seed, chunk_size=chunk_size, mesh=mesh_params)
+        level = cache.load(key)
+        if level is not None:
+            if progress is not None:
+                progress('Loading', 1, 1)
+            return level
+
+    with _collect('Generate'):
+        matrix = generator(width, height).generate(seed=seed, progress=progress, **params)
+    with _collect('Mesh'):
+        mesh = mesher.mesh_chunks(matrix, chunk_size, progress, **mesh_params)
+    with _collect('Collision'):
+        collision = mesher.box_chunks(matrix, chunk_size, progress)
+    level = {'grid': matrix, 'mesh': mesh, 'collision': collision}
+
+    if cache is not None:
+        with _collect('Cache'):
+            cache.save(key, level)
+
+    return level
 
 
 def render_map(matrix):
-    for row in matrix:
-        for cell in row:
-            if cell:
-                print(int(cell), end='')
-            else:
-                print(' ', end='')
-        print('')
+    for row in matrix.rows():
+        print(''.join('1' if cell else ' ' for cell in row))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""Greedy mesher for 2d maps
+
+Matrix is a Grid, True is a wall cell. Row index is Y and column index is X, cells out of the matrix are walls too.
+Lines of the matrix are taken as python ints, so runs are found with bit operations instead of cell by cell.
+"""
+
+import struct
+from array import array
+
+from panda3d.core import Geom, GeomNode, GeomTriangles, GeomVertexData, GeomVertexFormat, GeomEnums, NodePath
+
+from Utils.grid import bit_runs
+
+_QUAD = (0, 1, 2, 0, 2, 3)
+_QUAD_VERTICES = struct.Struct('=24f')  # 4 vertices of V3n3
+_indices = array('I')
+
+
+def pack_lines(matrix):
+    """Rows and columns of the Grid as ints"""
+    columns = matrix.transposed()
+
+    return [matrix.row_bits(y) for y in range(matrix.height)], [columns.row_bits(x) for x in range(matrix.width)]
+
+
+def wall_runs(rows, columns, x0, y0, x1, y1):
+    """Merged wall faces between solid and empty cells of the window
+    Faces belong to solid cells of the window, so neighbour windows never share a face
+    :return: list of (axis, plane, begin, end, sign), axis 'y' faces lie on plane y = const
+    """
+    faces = []
+
+    for axis, lines, a0, a1, b0, b1 in (('y', rows, y0, y1, x0, x1), ('x', columns, x0, x1, y0, y1)):
+        mask = ((1 << (b1 - b0)) - 1) << b0
+        size = len(lines)
+
+        for i in range(a0, a1):
+            line = lines[i] & mask
+            if not line:
+                continue
+
+            for sign in (-1, 1):
+                if not 0 <= i + sign < size:
+                    continue  # out of border is wall
+
+                plane = i + 1 if sign > 0 else i
+                for begin, end in bit_runs(line & ~lines[i + sign]):
+                    faces.append((axis, plane, begin, end, sign))
+
+    return faces
+
+
+def greedy_rects(rows, x0, y0, x1, y1, solid=False):
+    """Cover cells with given value by greedy merged rectangles
+    :return: list of (x, y, end_x, end_y)
+    """
+    mask = ((1 << (x1 - x0)) - 1) << x0
+    free = [(row if solid else ~row) & mask for row in rows[y0:y1]]
+    rects = []
+
+    for y in range(y0, y1):
+        bits = free[y - y0]
+
+        while bits:
+            low = bits & -bits
+            run = (bits ^ (bits + low)) & bits
+            bits ^= run
+
+            end_y = y + 1
+            while end_y < y1 and free[end_y - y0] & run == run:
+                free[end_y - y0] ^= run
+                end_y += 1
+
+            rects.append((low.bit_length() - 1, y, run.bit_length(), end_y))
+
+    return rects
+
+
+def quad_indices(count):
+    """Index array for count quads with 4 vertices each"""
+    global _indices
+
+    if len(_indices) < count * 6:
+        size = max(count, len(_indices) // 3)
+        _indices = array('I', [q * 4 + i for q in range(size) for i in _QUAD])
+
+    return _indices[:count * 6]
+
+
+def mesh_arrays(rows, columns, x0, y0, x1, y1, wall_height=3.0, cell_size=1.0, floor=True, ceiling=False):
+    """Vertex (V3n3) and index arrays for a window of the packed matrix"""
+    quads = []
+    add = quads.append
+    pack = _QUAD_VERTICES.pack
+    h = wall_height
+    s = cell_size
+
+    for axis, plane, begin, end, sign in wall_runs(rows, columns, x0, y0, x1, y1):
+        # bottom edge goes along (up x normal) to keep counter clockwise winding
+        p = plane * s
+        if axis == 'y':
+            a, b = (end * s, begin * s) if sign > 0 else (begin * s, end * s)
+            add(pack(a, p, 0, 0, sign, 0, b, p, 0, 0, sign, 0, b, p, h, 0, sign, 0, a, p, h, 0, sign, 0))
+        else:
+            a, b = (begin * s, end * s) if sign > 0 else (end * s, begin * s)
+            add(pack(p, a, 0, sign, 0, 0, p, b, 0, sign, 0, 0, p, b, h, sign, 0, 0, p, a, h, sign, 0, 0))
+
+    if floor or ceiling:
+        for x, y, end_x, end_y in greedy_rects(rows, x0, y0, x1, y1):
+            x, y, end_x, end_y = x * s, y * s, end_x * s, end_y * s
+            if floor:
+                add(pack(x, y, 0, 0, 0, 1, end_x, y, 0, 0, 0, 1, end_x, end_y, 0, 0, 0, 1, x, end_y, 0, 0, 0, 1))
+            if ceiling:
+                add(pack(x, end_y, h, 0, 0, -1, end_x, end_y, h, 0, 0, -1, end_x, y, h, 0, 0, -1, x, y, h, 0, 0, -1))
+
+    vertices = array('f')
+    vertices.frombytes(b''.join(quads))
+
+    return vertices, quad_indices(len(quads))
+
+
+def chunk_bounds(width, height, chunk_size):
+    """Yield (cx, cy, x0, y0, x1, y1) for each chunk of the map"""
+    for cy in range(0, height, chunk_size):
+        for cx in range(0, width, chunk_size):
+            yield cx // chunk_size, cy // chunk_size, cx, cy, min(cx + chunk_size, width), min(cy + chunk_size, height)
+
+
+def make_geom(vertices, indices):
+    """Build Geom copying whole arrays at once instead of writing vertex by vertex"""
+    vdata = GeomVertexData('map', GeomVertexFormat.getV3n3(), Geom.UHStatic)
+    vdata.modifyArray(0).modifyHandle().copyDataFrom(vertices)
+
+    prim = GeomTriangles(Geom.UHStatic)
+    prim.setIndexType(GeomEnums.NT_uint32)
+    prim.modifyVertices().modifyHandle().copyDataFrom(indices)
+
+    geom = Geom(vdata)
+    geom.addPrimitive(prim)
+
+    return geom
+
+
+def mesh_chunks(matrix, chunk_size=64, progress=None, **kwargs):
+    """Mesh arrays of all non empty chunks
+    :param Callable progress: called with (stage, done, total) after each chunk
+    :return: list of (cx, cy, vertices, indices)
+    """
+    rows, columns = pack_lines(matrix)
+    bounds = list(chunk_bounds(len(columns), len(rows), chunk_size))
+    chunks = []
+
+    for i, (cx, cy, x0, y0, x1, y1) in enumerate(bounds):
+        vertices, indices = mesh_arrays(rows, columns, x0, y0, x1, y1, **kwargs)
+        if indices:
+            chunks.append((cx, cy, vertices, indices))
+
+        if progress is not None:
+            progress('Meshing', i + 1, len(bounds))
+
+    return chunks
+
+
+def box_chunks(matrix, chunk_size=64, progress=None):
+    """Wall cells of every chunk merged into rectangles, collision is built from them instead of triangles
+    :return: list of (cx, cy, [(x, y, end_x, end_y), ...])
+    """
+    rows = [matrix.row_bits(y) for y in range(matrix.height)]
+    bounds = list(chunk_bounds(matrix.width, matrix.height, chunk_size))
+    chunks = []
+
+    for i, (cx, cy, x0, y0, x1, y1) in enumerate(bounds):
+        rects = greedy_rects(rows, x0, y0, x1, y1, solid=True)
+        if rects:
+            chunks.append((cx, cy, rects))
+
+        if progress is not None:
+            progress('Collision', i + 1, len(bounds))
+
+    return chunks
+
+
+def model_from_chunks(chunks, name='Map'):
+    """NodePath with one GeomNode per chunk"""
+    root = NodePath(name)
+
+    for cx, cy, vertices, indices in chunks:
+        node = GeomNode('chunk {} {}'.format(cx, cy))
+        node.addGeom(make_geom(vertices, indices))
+        root.attachNewNode(node)
+
+    return root
+
+
+def make_model(matrix, name='Map', chunk_size=64, **kwargs):
+    """NodePath with one GeomNode per chunk"""
+    return model_from_chunks(mesh_chunks(matrix, chunk_size, **kwargs), name)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+"""Navigation over map Grid
+
+Cells are (x, y), walls are True. Moves go to 8 neighbours, diagonal move is allowed only when both
+side cells are free, so paths never cut wall corners.
+"""
+
+import heapq
+from math import sqrt
+from array import array
+from collections import OrderedDict
+
+from Utils.grid import Grid
+
+SQRT2 = sqrt(2)
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+def octile(ax, ay, bx, by):
+    dx, dy = abs(ax - bx), abs(ay - by)
+
+    return (dx + dy) + (SQRT2 - 2) * min(dx, dy)
+
+
+class FlowField:
+    """Directions towards the target from every reachable cell"""
+
+    def __init__(self, target, width, directions, distances):
+        self.target = target
+        self.width = width
+        self.directions = directions  # index in DIRECTIONS + 1, 0 for unreachable cells and target
+        self.distances = distances
+
+    def direction(self, x, y):
+        """(dx, dy) of the next step or None"""
+        code = self.directions[y * self.width + x]
+
+        return DIRECTIONS[code - 1] if code else None
+
+    def distance(self, x, y):
+        dist = self.distances[y * self.width + x]
+
+        return None if dist < 0 else dist
+
+    def path(self, x, y):
+        """Follow the field from the cell to the target"""
+        if self.distance(x, y) is None:
+            return None
+
+        path = [(x, y)]
+        while (x, y) != self.target:
+            dx, dy = self.direction(x, y)
+            x, y = x + dx, y + dy
+            path.append((x, y))
+
+        return path
+
+
+class Pathfinder:
+    """Pathfinder(level.matrix)
+    Single queries use A* or jump point search, flow fields are shared by all agents going to the same target
+    """
+
+    def __init__(self, grid, max_fields=16):
+        self.grid = grid if isinstance(grid, Grid) else Grid.from_rows(grid)
+        self.max_fields = max_fields
+        self.fields = OrderedDict()
+
+    def free(self, x, y):
+        grid = self.grid
+        return 0 <= x < grid.width and 0 <= y < grid.height \
+            and not grid.data[y * grid.stride + (x >> 3)] >> (x & 7) & 1
+
+    def can_move(self, x, y, dx, dy):
+        if not self.free(x + dx, y + dy):
+            return False
+
+        return not (dx and dy) or (self.free(x + dx, y) and self.free(x, y + dy))
+
+    def neighbours(self, x, y):
+        for dx, dy in DIRECTIONS:
+            if self.can_move(x, y, dx, dy):
+                yield x + dx, y + dy, SQRT2 if dx and dy else 1
+
+    def find_path(self, start, goal, method='astar'):
+        """List of cells from start to goal or None if goal is unreachable
+        :param Str method: 'astar' or 'jps'
+        """
+        if method == 'astar':
+            return self.astar(start, goal)
+        elif method == 'jps':
+            return self.jps(start, goal)
+
+        raise ValueError('Unknown method: {}'.format(method))
+
+    def astar(self, start, goal):
+        if not (self.free(*start) and self.free(*goal)):
+            return None
+
+        gx, gy = goal
+        came_from = {start: None}
+        cost = {start: 0}
+        queue = [(octile(start[0], start[1], gx, gy), 0, start)]
+
+        while queue:
+            _, g, cell = heapq.heappop(queue)
+            if cell == goal:
+                return self.__reconstruct(came_from, goal)
+            if g > cost[cell]:
+                continue
+
+            for nx, ny, step in self.neighbours(*cell):
+                new_cost = g + step
+                if new_cost < cost.get((nx, ny), float('inf')):
+                    cost[nx, ny] = new_cost
+                    came_from[nx, ny] = cell
+                    heapq.heappush(queue, (new_cost + octile(nx, ny, gx, gy), new_cost, (nx, ny)))
+
+        return None
+
+    def jps(self, start, goal):
+        """Jump point search, expands only cells where path may turn"""
+        if not (self.free(*start) and self.free(*goal)):
+            return None
+
+        gx, gy = goal
+        came_from = {start: None}
+        cost = {start: 0}
+        queue = [(octile(start[0], start[1], gx, gy), 0, start)]
+
+        while queue:
+            _, g, cell = heapq.heappop(queue)
+            if cell == goal:
+                return self.__expand(self.__reconstruct(came_from, goal))
+            if g > cost[cell]:
+                continue
+
+            x, y = cell
+            for dx, dy in self.__pruned_directions(x, y, came_from[cell]):
+                point = self.__jump(x + dx, y + dy, dx, dy, goal)
+                if point is None:
+                    continue
+
+                new_cost = g + octile(x, y, point[0], point[1])
+                if new_cost < cost.get(point, float('inf')):
+                    cost[point] = new_cost
+                    came_from[point] = cell
+                    heapq.heappush(queue, (new_cost + octile(point[0], point[1], gx, gy), new_cost, point))
+
+        return None
+
+    def __pruned_directions(self, x, y, parent):
+        if parent is None:
+            return [(dx, dy) for dx, dy in DIRECTIONS if self.can_move(x, y, dx, dy)]
+
+        dx = (x > parent[0]) - (x < parent[0])
+        dy = (y > parent[1]) - (y < parent[1])
+        free = self.free
+        result = []
+
+        if dx and dy:
+            if free(x, y + dy):
+                result.append((0, dy))
+            if free(x + dx, y):
+                result.append((dx, 0))
+            if free(x, y + dy) and free(x + dx, y) and free(x + dx, y + dy):
+                result.append((dx, dy))
+        elif dx:
+            up, down = free(x, y + 1), free(x, y - 1)
+            if free(x + dx, y):
+                result.append((dx, 0))
+                if up and free(x + dx, y + 1):
+                    result.append((dx, 1))
+                if down and free(x + dx, y - 1):
+                    result.append((dx, -1))
+            if up:
+                result.append((0, 1))
+            if down:
+                result.append((0, -1))
+        else:
+            right, left = free(x + 1, y), free(x - 1, y)
+            if free(x, y + dy):
+                result.append((0, dy))
+                if right and free(x + 1, y + dy):
+                    result.append((1, dy))
+                if left and free(x - 1, y + dy):
+                    result.append((-1, dy))
+            if right:
+                result.append((1, 0))
+            if left:
+                result.append((-1, 0))
+
+        return result
+
+    def __jump(self, x, y, dx, dy, goal):
+        """Walk in direction until a cell with forced neighbours, goal or wall"""
+        free = self.free
+
+        while free(x, y):
+            if (x, y) == goal:
+                return x, y
+
+            if dx and dy:
+                if self.__jump(x + dx, y, dx, 0, goal) or self.__jump(x, y + dy, 0, dy, goal):
+                    return x, y
+            elif dx:
+                if (free(x, y - 1) and not free(x - dx, y - 1)) or (free(x, y + 1) and not free(x - dx, y + 1)):
+                    return x, y
+            elif (free(x - 1, y) and not free(x - 1, y - dy)) or (free(x + 1, y) and not free(x + 1, y - dy)):
+                return x, y
+
+            if not (free(x + dx, y) and free(x, y + dy)):
+                return None
+            x, y = x + dx, y + dy
+
+        return None
+
+    @staticmethod
+    def __reconstruct(came_from, goal):
+        path = [goal]
+        while came_from[path[-1]] is not None:
+            path.append(came_from[path[-1]])
+        path.reverse()
+
+        return path
+
+    @staticmethod
+    def __expand(points):
+        """Cells between jump points, they always lie on straight or diagonal lines"""
+        path = [points[0]]
+
+        for (x, y), (tx, ty) in zip(points, points[1:]):
+            dx, dy = (tx > x) - (tx < x), (ty > y) - (ty < y)
+            while (x, y) != (tx, ty):
+                x, y = x + dx, y + dy
+                path.append((x, y))
+
+        return path
+
+    def flow_field(self, target):
+        """Cached field towards the target cell"""
+        if target in self.fields:
+            self.fields.move_to_end(target)
+            return self.fields[target]
+
+        field = self.__build_field(target)
+        self.fields[target] = field
+        while len(self.fields) > self.max_fields:
+            self.fields.popitem(last=False)
+
+        return field
+
+    def direction(self, cell, target):
+        """Next step from cell to target using shared flow field"""
+        return self.flow_field(target).direction(*cell)
+
+    def invalidate(self, target=None):
+        """Forget flow fields, call it after the grid is changed"""
+        if target is None:
+            self.fields.clear()
+        else:
+            self.fields.pop(target, None)
+
+    def __build_field(self, target):
+        """Dijkstra from the target over the whole grid"""
+        width, height = self.grid.width, self.grid.height
+        distances = array('d', [-1.0]) * (width * height)
+        directions = bytearray(width * height)
+
+        if not self.free(*target):
+            return FlowField(target, width, directions, distances)
+
+        back = {d: i + 1 for i, d in enumerate(DIRECTIONS)}
+        distances[target[1] * width + target[0]] = 0
+        queue = [(0, target)]
+
+        while queue:
+            dist, (x, y) = heapq.heappop(queue)
+            if dist > distances[y * width + x]:
+                continue
+
+            for nx, ny, step in self.neighbours(x, y):
+                i = ny * width + nx
+                new_dist = dist + step
+                if distances[i] < 0 or new_dist < distances[i]:
+                    distances[i] = new_dist
+                    directions[i] = back[x - nx, y - ny]
+                    heapq.heappush(queue, (new_dist, (nx, ny)))
+
+        return FlowField(target, width, directions, distances)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""Connected regions of empty cells in a Grid
+
+Labeling works on runs of empty cells instead of single cells: runs of neighbour rows that overlap
+are joined with union-find, so the pass is linear in number of runs.
+Cells are connected by sides only, diagonal gaps are too narrow to walk through.
+"""
+
+from bisect import bisect_right, insort
+
+from Utils.grid import bit_runs
+
+
+class Region:
+    __slots__ = ('label', 'size', 'x0', 'y0', 'x1', 'y1', 'runs')
+
+    def __init__(self, label):
+        self.label = label
+        self.size = 0
+        self.x0 = self.y0 = float('inf')
+        self.x1 = self.y1 = -1
+        self.runs = []  # (y, begin, end)
+
+    @property
+    def bounds(self):
+        """(x0, y0, x1, y1), end is exclusive"""
+        return self.x0, self.y0, self.x1, self.y1
+
+    def add(self, y, begin, end):
+        self.runs.append((y, begin, end))
+        self.size += end - begin
+        self.x0 = min(self.x0, begin)
+        self.x1 = max(self.x1, end)
+        self.y0 = min(self.y0, y)
+        self.y1 = max(self.y1, y + 1)
+
+    def cell(self):
+        """Some cell of the region"""
+        y, begin, end = self.runs[len(self.runs) // 2]
+        return (begin + end - 1) // 2, y
+
+    def __repr__(self):
+        return 'Region({}, size={}, bounds={})'.format(self.label, self.size, self.bounds)
+
+
+class RunIndex:
+    """Runs of several regions by rows, to find the closest cell of them"""
+
+    def __init__(self):
+        self.rows = {}
+        self.y0 = float('inf')
+        self.y1 = -1
+
+    def add(self, region):
+        for y, begin, end in region.runs:
+            insort(self.rows.setdefault(y, []), (begin, end))
+        self.y0 = min(self.y0, region.y0)
+        self.y1 = max(self.y1, region.y1)
+
+    def nearest(self, x, y):
+        """Rows are checked outwards from the point until they are farther than the best found cell"""
+        best, best_dist = None, float('inf')
+        d = 0
+
+        while d * d < best_dist and (y - d >= self.y0 or y + d < self.y1):
+            for ry in {y - d, y + d}:
+                row = self.rows.get(ry)
+                if not row:
+                    continue
+
+                i = bisect_right(row, (x, float('inf')))
+                for begin, end in row[max(i - 1, 0):i + 1]:
+                    rx = min(max(x, begin), end - 1)
+                    dist = (rx - x) ** 2 + d * d
+                    if dist < best_dist:
+                        best, best_dist = (rx, ry), dist
+            d += 1
+
+        return best
+
+
+def label(grid):
+    """Connected regions of empty cells, largest first"""
+    mask = (1 << grid.width) - 1
+    parent = []
+    runs = []
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    previous = []
+    for y in range(grid.height):
+        current = []
+        for begin, end in bit_runs(~grid.row_bits(y) & mask):
+            parent.append(len(runs))
+            current.append(len(runs))
+            runs.append((y, begin, end))
+
+        i = j = 0
+        while i < len(previous) and j < len(current):
+            _, pb, pe = runs[previous[i]]
+            _, cb, ce = runs[current[j]]
+
+            if pb < ce and cb < pe:
+                a, b = find(previous[i]), find(current[j])
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+
+            if pe < ce:
+                i += 1
+            else:
+                j += 1
+
+        previous = current
+
+    regions = {}
+    for i, run in enumerate(runs):
+        root = find(i)
+        if root not in regions:
+            regions[root] = Region(len(regions))
+        regions[root].add(*run)
+
+    result = sorted(regions.values(), key=lambda r: r.size, reverse=True)
+    for i, region in enumerate(result):
+        region.label = i
+
+    return result
+
+
+def fill(grid, regions):
+    """Turn cells of given regions into walls"""
+    rows = {}
+
+    for region in regions:
+        for y, begin, end in region.runs:
+            rows[y] = rows.get(y, 0) | ((1 << (end - begin)) - 1) << begin
+
+    for y, bits in rows.items():
+        grid.set_row_bits(y, grid.row_bits(y) | bits)
+
+
+def carve(grid, start, end):
+    """Dig L-shaped tunnel between two cells"""
+    (x0, y0), (x1, y1) = start, end
+
+    for x in range(min(x0, x1), max(x0, x1) + 1):
+        grid.set(x, y0, False)
+    for y in range(min(y0, y1), max(y0, y1) + 1):
+        grid.set(x1, y, False)
+
+
+def connect(grid, regions):
+    """Dig tunnels from every region to the nearest already connected one
+    Regions are joined starting from the first one and then by distance to it, which keeps tunnels short
+    """
+    if len(regions) < 2:
+        return
+
+    connected = RunIndex()
+    connected.add(regions[0])
+    cx, cy = regions[0].cell()
+
+    for region in sorted(regions[1:], key=lambda r: (r.cell()[0] - cx) ** 2 + (r.cell()[1] - cy) ** 2):
+        start = region.cell()
+        carve(grid, start, connected.nearest(*start))
+        connected.add(region)
+
+
+def cleanup(grid, mode='fill', min_size=0):
+    """Leave only one region of empty cells
+    :param Str mode: 'fill' unreachable regions with walls or 'connect' them to the largest one with tunnels
+    :param Int min_size: regions smaller than this are filled in both modes
+    :return: regions found before cleanup
+    """
+    if mode not in ('fill', 'connect'):
+        raise ValueError('Unknown cleanup mode: {}'.format(mode))
+
+    regions = label(grid)
+    if not regions:
+        return regions
+
+    small = [r for r in regions[1:] if mode == 'fill' or r.size < min_size]
+    fill(grid, small)
+
+    if mode == 'connect':
+        connect(grid, [regions[0]] + [r for r in regions[1:] if r.size >= min_size])
+
+    return regions
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""CharacterController.update microbenchmark on a synthetic BulletWorld, runs without a window
+
+    python -m benchmarks.kcc --characters 1 16 64 --output kcc.json
+    python -m benchmarks.kcc --baseline HEAD~1
+
+Time is per update call, memory is mean tracemalloc peak of one call, which is what the call allocates
+and frees on the way. With --baseline the controller of App/KCC.py at a git revision is measured too,
+on the same world, so numbers of a change can be compared in one run.
+"""
+
+import sys
+import json
+import time
+import types
+import inspect
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+from panda3d.core import loadPrcFileData, Vec3, BitMask32
+
+loadPrcFileData('', 'window-type none\naudio-library-name null')
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.bullet import BulletWorld, BulletPlaneShape, BulletBoxShape, BulletRigidBodyNode
+
+from App.KCC import CharacterController
+from App.Physics import ContactIndex
+
+TICK = 1 / 60
+
+
+def make_world(root, boxes=32):
+    """Floor with a row of static boxes the characters walk into"""
+    world = BulletWorld()
+    world.setGravity(Vec3(0, 0, -9.81))
+
+    floor = root.attachNewNode(BulletRigidBodyNode('Floor'))
+    floor.node().addShape(BulletPlaneShape(Vec3(0, 0, 1), 0))
+    world.attachRigidBody(floor.node())
+
+    for i in range(boxes):
+        box = root.attachNewNode(BulletRigidBodyNode('Box'))
+        box.node().addShape(BulletBoxShape(Vec3(.5, .5, 1)))
+        box.setPos(i * 2, 3, 1)
+        world.attachRigidBody(box.node())
+
+    root.setCollideMask(BitMask32.allOn())
+
+    return world
+
+
+def load_controller(revision):
+    """CharacterController class of App/KCC.py at a git revision"""
+    name = 'App/KCC.py@' + revision
+    source = subprocess.check_output(['git', 'show', '{}:App/KCC.py'.format(revision)])
+    module = types.ModuleType('kcc_baseline')
+    exec(compile(source, name, 'exec'), module.__dict__)
+
+    return module.CharacterController
+
+
+def run(count, ticks, repeat, controller=CharacterController):
+    root = render.attachNewNode('Bench')
+    world = make_world(root)
+    contacts = ContactIndex()
+    bodies = []
+    # controllers older than the shared contact index take no contacts and cast their own rays
+    kwargs = {'contacts': contacts} if 'contacts' in inspect.signature(controller).parameters else {}
+
+    for i in range(count):
+        body = controller(world, root, 1.8, 1.2, .3, .3, **kwargs)
+        body.setPos(i * 2 % 64, 0, 0)
+        bodies.append(body)
+
+    move = Vec3(0, 2, 0)
+
+    def step():
+        world.doPhysics(TICK, 1, TICK)
+        contacts.rebuild(world)
+
+    for _ in range(10):  # settle on the floor
+        step()
+        for body in bodies:
+            body.update(TICK, move, 0)
+
+    best = float('inf')
+    for _ in range(repeat):
+        elapsed = 0
+        for _ in range(ticks):
+            step()
+            start = time.perf_counter()
+            for body in bodies:
+                body.update(TICK, move, 10)
+            elapsed += time.perf_counter() - start
+        best = min(best, elapsed)
+
+    peaks = 0
+    for _ in range(ticks):
+        step()
+        for body in bodies:
+            tracemalloc.start()
+            body.update(TICK, move, 10)
+            peaks += tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    root.removeNode()
+
+    calls = ticks * count
+    return {'characters': count, 'us_per_call': best / calls * 1e6, 'bytes_per_call': peaks / calls}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--characters', type=int, nargs='+', default=(1, 16, 64))
+    parser.add_argument('--ticks', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', help='git revision of App/KCC.py to compare with')
+    parser.add_argument('--output', help='write results as json')
+    args = parser.parse_args(argv)
+
+    controllers = [('current', CharacterController)]
+    if args.baseline:
+        controllers.insert(0, (args.baseline, load_controller(args.baseline)))
+
+    ShowBase()
+    results = []
+    for count in args.characters:
+        for code, controller in controllers:
+            result = run(count, args.ticks, args.repeat, controller)
+            result['code'] = code
+            results.append(result)
+            print('{characters:>4} characters {us_per_call:>8.1f} us/call {bytes_per_call:>8.0f} B/call  {code}'.format(
+                **result))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'results': results},
+                      file, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
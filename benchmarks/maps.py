@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""Map pipeline benchmark, runs without a window
+
+    python -m benchmarks.maps --sizes 64 256 1024 --output maps.json
+    python -m benchmarks.maps --compare maps.json
+
+Every stage is timed best of --repeat runs, then run once more under tracemalloc for peak python memory.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from Utils import mesher, regions
+from Utils.geom import bullet_map_from
+from Utils.mapCache import MapCache
+from Utils.mapGenerators import Cave
+
+SIZES = (64, 128, 256, 512, 1024, 2048, 4096)
+STAGES = ('generate', 'label', 'mesh', 'collision', 'bodies', 'save', 'load')
+
+
+def stages(size, backend, cache_dir):
+    """Yield (name, func), func takes result of the previous stage it needs"""
+    level = {}
+
+    def generate():
+        level['grid'] = Cave(size, size).generate(seed=1, steps=4, backend=backend)
+
+    def label():
+        regions.label(level['grid'])
+
+    def mesh():
+        level['mesh'] = mesher.mesh_chunks(level['grid'])
+
+    def collision():
+        level['collision'] = mesher.box_chunks(level['grid'])
+
+    def bodies():
+        bullet_map_from(level['collision'], size, size)
+
+    cache = MapCache(cache_dir)
+
+    def save():
+        cache.save('bench', level)
+
+    def load():
+        cache.load('bench')
+
+    return zip(STAGES, (generate, label, mesh, collision, bodies, save, load))
+
+
+def measure(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def run(sizes, repeat, backend):
+    results = []
+    cache_dir = tempfile.mkdtemp(prefix='map-bench-')
+
+    try:
+        for size in sizes:
+            for stage, func in stages(size, backend, cache_dir):
+                seconds, peak = measure(func, repeat)
+                results.append({'size': size, 'stage': stage, 'seconds': seconds, 'peak_bytes': peak})
+                print('{:>5} {:<10} {:>10.4f} s {:>10.1f} MiB'.format(size, stage, seconds, peak / 2 ** 20))
+
+            size_on_disk = os.path.getsize(os.path.join(cache_dir, 'bench.map'))
+            print('{:>5} {:<10} {:>10.1f} KiB on disk'.format(size, 'file', size_on_disk / 2 ** 10))
+    finally:
+        shutil.rmtree(cache_dir)
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': backend,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """Print time ratios against baseline, return number of regressions"""
+    old = {(r['size'], r['stage']): r for r in baseline['results']}
+    regressions = 0
+
+    for result in report['results']:
+        previous = old.get((result['size'], result['stage']))
+        if previous is None or not previous['seconds']:
+            continue
+
+        ratio = result['seconds'] / previous['seconds']
+        slow = ratio > threshold
+        regressions += slow
+        print('{:>5} {:<10} x{:<6.2f}{}'.format(result['size'], result['stage'], ratio, ' REGRESSION' if slow else ''))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backend', choices=Cave.backends, default='python')
+    parser.add_argument('--output', help='write results as json')
+    parser.add_argument('--compare', help='json of a previous run')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio counted as regression')
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat, args.backend)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            if compare(report, json.load(file), args.threshold):
+                return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
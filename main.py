@@ -12,6 +12,8 @@ from Utils import win
 from App.Managers import GameManager
 from App.Options import Options
 from App.Gui import Loading
+from App.Background import Job
+from App import Stats
 
 
 class App(ShowBase):
@@ -34,6 +36,7 @@ class App(ShowBase):
 
         self.accept('Exit', self.userExit)
         self.accept('alt-enter', win.toggle_fullscreen)
+        self.accept('f2', Stats.toggle)
         self.accept('f12', self.screenshot, [str(Filename.fromOsSpecific(udir + '/screenshots/scr'))])
 
         base.buttonThrowers[0].node().setButtonDownEvent('Any-key-pressed')
@@ -47,6 +50,10 @@ class App(ShowBase):
             self.manager.request('Menu')
         self.taskMgr.doMethodLater(.1, start, 'Show menu')
 
+    def userExit(self):
+        Job.shutdown()
+        ShowBase.userExit(self)
+
     def get_user_dir(self):
         udir = os.path.join(os.path.expanduser('~'), self.company, self.name)
 
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+"""Dedicated Game server simulated without window, GUI and audio
+
+    python server.py --port 7777 --mode default
+    python server.py --bots 4 --ticks 600
+    python server.py --connect 127.0.0.1:7777 --bots 4
+
+Level of the mode is generated with its seed, so clients build the same one. Bots are scripted UDP clients,
+with --connect they join a running server, otherwise the local one over loopback, in the same process.
+"""
+
+import time
+import random
+import argparse
+
+from panda3d.core import loadPrcFile, loadPrcFileData, Vec3
+
+
+class Bot:
+    """Scripted inputs sent by a Client: walks, turns and jumps by a seeded schedule"""
+
+    def __init__(self, client, seed):
+        self.client = client
+        self.random = random.Random(seed)
+        self.next_change = 0
+
+    def __call__(self, tick):
+        if tick >= self.next_change:
+            rnd = self.random
+            command = self.client.command
+            command.move(Vec3(rnd.choice((-1, 0, 1)), rnd.choice((0, 1, 1)), 0))
+            command.turn(rnd.uniform(-90, 90))
+            if rnd.random() < .2:
+                command.jump()
+
+            self.next_change = tick + rnd.randint(30, 120)
+
+        self.client.send()
+
+        return self.client.poll()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=None, help='7777 by default, 0 picks a free one')
+    parser.add_argument('--mode', default='default')
+    parser.add_argument('--max-clients', type=int, default=8)
+    parser.add_argument('--snapshot-interval', type=int, default=1, help='ticks between snapshots')
+    parser.add_argument('--ticks', type=int, default=0, help='ticks to run, 0 for no limit')
+    parser.add_argument('--bots', type=int, default=0, help='scripted clients')
+    parser.add_argument('--connect', default=None, help='host:port of a running server the bots join')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the bots')
+    parser.add_argument('--report', type=int, default=600, help='ticks between progress lines, 0 for none')
+
+    return parser.parse_args()
+
+
+def start_bots(address, count, seed):
+    from App.Net import Client
+
+    bots = []
+    for i in range(count):
+        client = Client(address)
+        client.connect()
+        bots.append(Bot(client, seed * 1000 + i))
+
+    return bots
+
+
+def report(tick, server, bots):
+    line = '{:7d} ticks'.format(tick)
+
+    if server is not None:
+        line += ' {:3d} clients {:8d} in {:8d} out'.format(len(server.clients), server.received, server.sent)
+
+    clients = [bot.client for bot in bots if bot.client.connected]
+    if bots:
+        rtts = [client.rtt for client in clients if client.rtt is not None]
+        line += ' {:3d}/{} bots'.format(len(clients), len(bots))
+        if rtts:
+            line += ' rtt {:.1f} ms'.format(sum(rtts) / len(rtts) * 1000)
+        if clients:
+            line += ' snapshot tick {}'.format(max(client.tick for client in clients))
+
+    print(line)
+
+
+def run_bots(args):
+    """Bots only, ticking at the rate the server tells them"""
+    from App.Net import PORT
+
+    host, _, port = args.connect.partition(':')
+    if not port:
+        port = PORT if args.port is None else args.port
+    bots = start_bots((host, int(port)), args.bots, args.seed)
+
+    tick = 0
+    dt = 1 / 60
+    next_tick = time.perf_counter()
+    while bots and (not args.ticks or tick < args.ticks):
+        tick += 1
+        bots = [bot for bot in bots if bot(tick)]
+        if bots and bots[0].client.tick_rate:
+            dt = 1 / bots[0].client.tick_rate
+
+        if args.report and tick % args.report == 0:
+            report(tick, None, bots)
+
+        next_tick += dt
+        time.sleep(max(next_tick - time.perf_counter(), 0))
+
+    for bot in bots:
+        bot.client.close()
+
+
+def main():
+    args = parse_args()
+
+    if args.connect is not None:
+        return run_bots(args)
+
+    loadPrcFile('local.prc')
+    loadPrcFileData('headless', 'window-type none\naudio-library-name null\nmodel-path $MAIN_DIR/assets/\n')
+
+    from direct.showbase.ShowBase import ShowBase
+    from App.Physics import World
+    from App.Net import Server, PORT, spawn_points
+    from Scenes.Game import Game
+    from Utils.mapGenerators import build
+
+    ShowBase()
+
+    level = build(**Game.level_for(args.mode))
+    matrix = level['grid']
+    cell_size = (Game.level_for(args.mode).get('mesh_params') or {}).get('cell_size', 1.0)
+
+    world = World()
+    world.node.reparentTo(render)
+    collision = Game.collision_for(args.mode, level)
+    collision.reparentTo(render)
+    for body in collision.getChildren():
+        world.attach_body(body.node())
+
+    spawns = spawn_points(matrix, args.max_clients, cell_size=cell_size)
+    port = PORT if args.port is None else args.port
+    server = Server(world, render, spawns, (args.host, port), args.mode, args.max_clients, args.snapshot_interval)
+    print('Serving {} on {}:{}, {} ticks/s'.format(args.mode, server.address[0], server.address[1], world.tick_rate))
+
+    bots = start_bots(('127.0.0.1', server.address[1]), args.bots, args.seed)
+
+    def on_tick(tick):
+        for bot in bots:
+            bot(tick)
+
+        if args.report and tick % args.report == 0:
+            report(tick, server, bots)
+
+    start = time.perf_counter()
+    try:
+        server.run(args.ticks, on_tick)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.perf_counter() - start
+    print('{} ticks in {:.2f} s'.format(world.ticks, elapsed))
+
+    for bot in bots:
+        bot.client.close()
+    server.close()
+    world.destroy()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""Practice scene simulated without window, GUI and audio
+
+    python sim.py --characters 16 --ticks 3600
+
+Characters walk by seeded scripted inputs, physics ticks run back to back and simulated ticks per second
+are reported, so simulation can be load tested on machines without GPU.
+A character falling out of the map is a bug of the simulation: it is put back to spawn so the run goes on,
+but the run fails with exit status 1.
+"""
+
+import sys
+import math
+import time
+import random
+import argparse
+
+from panda3d.core import loadPrcFile, loadPrcFileData, Vec3, Point3
+
+
+class Script:
+    """Scripted inputs of a character: walks, turns and jumps by a seeded schedule, heads back when too far
+    Characters fallen out of the map are put back to the spawn point
+    """
+
+    def __init__(self, char, seed, spawn, radius=15, kill_z=-50):
+        self.char = char
+        self.random = random.Random(seed)
+        self.spawn = spawn
+        self.radius = radius
+        self.kill_z = kill_z
+        self.next_change = 0
+        self.respawns = 0
+
+    def __call__(self, tick):
+        if tick < self.next_change:
+            return
+
+        rnd = self.random
+        pos = self.char.getPos(render)
+        if pos.z < self.kill_z:
+            self.char.setPos(self.spawn)
+            self.respawns += 1
+        self.char.move(Vec3(rnd.choice((-1, 0, 1)), rnd.choice((0, 1, 1)), 0))
+        self.char.turn(rnd.uniform(-90, 90))
+
+        self.next_change = tick + rnd.randint(30, 120)
+
+        if pos.getXy().length() > self.radius:
+            heading = math.degrees(math.atan2(pos.x, -pos.y))  # to the center
+            self.char.move(Vec3(0, 1, 0))
+            self.char.turn((heading - self.char.getH() + 180) % 360 - 180)  # in a second
+            self.next_change = tick + 60
+
+        if rnd.random() < .2:
+            self.char.jump()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--characters', type=int, default=8)
+    parser.add_argument('--ticks', type=int, default=3600, help='physics ticks to simulate')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--report', type=int, default=600, help='ticks between progress lines, 0 for none')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    loadPrcFile('local.prc')
+    loadPrcFileData('headless', 'window-type none\naudio-library-name null\nmodel-path $MAIN_DIR/assets/\n')
+
+    from direct.showbase.ShowBase import ShowBase
+    from App.Physics import World
+    from App.Characters import Character, CharacterManager
+    from App.Hero import get_active_hero
+    from Scenes.Practice import load_props
+
+    ShowBase()
+
+    world = World()
+    world.node.reparentTo(render)
+    load_props(world, render, models=False)
+
+    characters = CharacterManager(world)
+    scripts = []
+    rnd = random.Random(args.seed)
+    for i in range(args.characters):
+        spawn = Point3(rnd.uniform(-8, 8), rnd.uniform(-8, 8), 3)
+        char = Character(world, render, get_active_hero())
+        char.setPos(spawn)
+        characters.add(char)
+        scripts.append(Script(char, args.seed * 1000 + i, spawn))
+
+    print('{} characters, {} bodies, tick {:.4f} s'.format(len(characters), world.world.getNumRigidBodies(),
+                                                           world.tick_dt))
+
+    start = last = time.perf_counter()
+    for tick in range(1, args.ticks + 1):
+        for script in scripts:
+            script(tick)
+        world.tick()
+
+        if args.report and tick % args.report == 0:
+            now = time.perf_counter()
+            print('{:7d} ticks {:10.1f} ticks/s'.format(tick, args.report / (now - last)))
+            last = now
+
+    elapsed = time.perf_counter() - start
+    respawns = sum(script.respawns for script in scripts)
+    print('{} ticks in {:.2f} s: {:.1f} ticks/s, {:.1f}x real time'.format(
+        args.ticks, elapsed, args.ticks / elapsed, args.ticks * world.tick_dt / elapsed))
+
+    characters.destroy()
+    world.destroy()
+
+    if respawns:
+        print('FAILED: characters fell out of the map {} times'.format(respawns))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())